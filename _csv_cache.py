@@ -0,0 +1,108 @@
+# _csv_cache.py — CSV 読み込みの共有キャッシュ
+# - search_core / postprocess / nlp_extract / search_adapter が同じ CSV を個別に開いていたのを1回にまとめる
+# - キーは (path, mtime)。CSV を差し替えれば次の呼び出しで読み直す
+# - 返す DataFrame / 行リストは共有物なので、呼び出し側で書き換えないこと（必要ならコピー）
+from __future__ import annotations
+
+import io
+import os
+import sys
+import csv
+import codecs
+import threading
+import importlib.util
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# pyarrow（任意）があれば pyarrow.csv（C++ 並列トークナイザ）で読む。
+# import 自体は pandas と同じく初回読み込みまで遅らせる（存在確認だけ）
+_HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+# 値の種類が少ない列（◎/○/△・単一/一次/二次 など）は intern して同じ文字列オブジェクトを共有
+_INTERN_COLS = ("作業効率評価", "工程数", "機械カテゴリー", "作業名")
+
+def _sniff_encoding(data: bytes) -> str:
+    """UTF-8（BOM 有無どちらも）優先、UTF-8 として読めなければ cp932。"""
+    if data.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        data.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp932"
+
+def file_key(path: str) -> Tuple[str, float]:
+    """キャッシュキー (絶対パス, 更新時刻)。"""
+    p = os.path.abspath(path)
+    return (p, os.path.getmtime(p))
+
+def _read_arrow(data: bytes, encoding: str) -> Optional[pd.DataFrame]:
+    """pyarrow.csv で全列 string として読む。使えない/読めないときは None（C エンジンに任せる）。
+
+    pandas の engine="pyarrow" は dtype=str でも先に数値推論してから str に戻すため
+    "01"→"1"・"0.50"→"0.5" と化ける。列型を先に全部 string で指定して推論させない。
+    """
+    if not _HAS_PYARROW:
+        return None
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+
+        # 列名はヘッダ行だけ先に取る（cp932 の2バイト目に 0x0A は出ないので改行で切ってよい）
+        header = next(csv.reader([data.split(b"\n", 1)[0].decode(encoding).rstrip("\r")]))
+        # 空/重複の列名は pandas 側の命名（Unnamed: n / x.1）に合わせられないので C エンジンへ
+        if not all(header) or len(set(header)) != len(header):
+            return None
+        table = pacsv.read_csv(
+            io.BytesIO(data),
+            read_options=pacsv.ReadOptions(encoding=encoding),
+            convert_options=pacsv.ConvertOptions(
+                column_types={c: pa.string() for c in header},
+                strings_can_be_null=False,  # 空欄は "" のまま（keep_default_na=False 相当）
+            ),
+        )
+        return table.to_pandas()
+    except Exception:
+        return None
+
+# lru_cache は同時ミス時に両方が計算するので、初回読み込みはロックで1回に絞る
+_READ_LOCK = threading.Lock()
+
+@lru_cache(maxsize=4)
+def _read_frame(key: Tuple[str, float]) -> pd.DataFrame:
+    import pandas as pd  # 起動時（import 時）には読み込まない
+
+    # ファイルは1回だけ読み、エンコーディングを判定してからそのバイト列をパースする（例外駆動の再読込なし）
+    with open(key[0], "rb") as f:
+        data = f.read()
+    encoding = _sniff_encoding(data)
+    df = _read_arrow(data, encoding)
+    if df is None:
+        df = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, encoding=encoding)
+    df = df.fillna("")
+    for col in _INTERN_COLS:
+        if col in df.columns:
+            df[col] = df[col].map(sys.intern)
+    return df
+
+@lru_cache(maxsize=4)
+def _read_rows(key: Tuple[str, float]) -> List[Dict[str, str]]:
+    return _read_frame(key).to_dict("records")
+
+def read_frame(path: str) -> pd.DataFrame:
+    """全列 str・空欄は "" の DataFrame（共有。書き換え禁止）。"""
+    with _READ_LOCK:
+        return _read_frame(file_key(path))
+
+def read_rows(path: str) -> List[Dict[str, str]]:
+    """read_frame と同じ内容の行 dict リスト（共有。書き換え禁止）。"""
+    with _READ_LOCK:
+        return _read_rows(file_key(path))
+
+def clear() -> None:
+    """テスト/リロード用"""
+    _read_frame.cache_clear()
+    _read_rows.cache_clear()
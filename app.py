@@ -17,9 +17,12 @@ import os
 import re
 import json
 import math
+import asyncio
+import threading
 from typing import Dict, List, Optional, Tuple
 
 from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, PlainTextResponse
 import pandas as pd
 
@@ -27,6 +30,7 @@ import pandas as pd
 from formatters import to_plain_text  # 件数ヘッダ・空行・並び順・（ペア候補）表示＋工程ラベル
 from search_core import prepare_with_pairs  # ペア候補を未絞り込み結果から補完
 from postprocess import reorder_and_pair    # あれば利用（一次/二次の並び整形）
+from postprocess import warm_groups as _warm_pair_groups  # 起動時の索引プリフェッチ用
 
 # ====== LINE SDK（未設定ならダミーで起動可能） ======
 try:
@@ -36,6 +40,9 @@ try:
         MessageEvent, TextMessage, TextSendMessage,
         QuickReply, QuickReplyButton, MessageAction,
     )
+    from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+    import requests
+    from requests.adapters import HTTPAdapter
     LINE_AVAILABLE = True
 except Exception:
     LINE_AVAILABLE = False
@@ -90,6 +97,25 @@ def version():
 @app.on_event("startup")
 async def _boot_log():
     logger.info(f"[BOOT] {APP_VERSION} commit={GIT_SHA}")
+
+_WARMUP_TASK: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def _prefetch_caches():
+    # 一次/二次ペア補完の索引（CSV 全体の読み込み＋グループ化）は初回の reorder_and_pair で作られるため、
+    # 起動直後にスレッドで先に作っておく。待たずに受付を始め、最初の Webhook と重なった場合は
+    # そのリクエストが索引のロック（_GROUPS_LOCK）で構築完了を待つ（二重には作らない）
+    global _WARMUP_TASK
+    _WARMUP_TASK = asyncio.create_task(run_in_threadpool(_warm_pair_groups))
+    _WARMUP_TASK.add_done_callback(_log_warmup_result)
+
+def _log_warmup_result(task: asyncio.Task) -> None:
+    # 失敗しても受付は続ける（初回の reorder_and_pair で作り直す）。黙って落ちないようログだけ残す
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.error("[BOOT] pair index prefetch failed", exc_info=exc)
     
 # =============================
 # データ読み込み
@@ -139,10 +165,11 @@ ZEN2HAN_TABLE = str.maketrans({
     "０":"0","１":"1","２":"2","３":"3","４":"4",
     "５":"5","６":"6","７":"7","８":"8","９":"9"
 })
+_DIGITS_RE = re.compile(r"\d+")
 
 def to_int_or_none(text: str) -> Optional[int]:
     t = (text or "").strip().translate(ZEN2HAN_TABLE)
-    if re.fullmatch(r"\d+", t):
+    if _DIGITS_RE.fullmatch(t):
         try:
             return int(t)
         except Exception:
@@ -188,52 +215,63 @@ def _annotate_stage_flags(rows: List[Dict]) -> List[Dict]:
 # ---- 深さ/厚さユーティリティ -------------------------------
 _NUM_RE = re.compile(r"(\d+(?:\.\d+)?)")
 
+# 全角→半角（辞書版：1:1 マッピング）。呼び出しごとに作らずモジュールで1回だけ構築
+_DEPTH_Z2H_TABLE = str.maketrans({
+    "－": "-", "ー": "-",  # 長音もハイフン扱い（保険）
+    "０": "0","１": "1","２": "2","３": "3","４": "4",
+    "５": "5","６": "6","７": "7","８": "8","９": "9",
+    "．": ".", "。": ".",  # 句点混入の保険
+    "〜": "-","～": "-","~": "-",   # 波ダッシュ/チルダもハイフン扱い
+    "–": "-","—": "-","―": "-","‐": "-",
+    "㎜": "mm",
+    " ": None,
+})
+_DEPTH_NUM_ONLY_RE = re.compile(r"\d+(?:\.\d+)?")
+_DEPTH_MM_TAIL_RE = re.compile(r"(?<=\d)\s*mm$", re.I)
+
+# CSV セル側の表記ゆれ（㎜・波ダッシュ・各種ダッシュ）を1回の translate で揃える
+_DEPTH_CELL_TABLE = str.maketrans({
+    "㎜": "mm", "〜": "~", "～": "~",
+    "–": "-", "—": "-", "―": "-", "‐": "-", "−": "-",
+})
+_DEPTH_RANGE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*[-~]\s*(\d+(?:\.\d+)?)")   # a-b / a~b
+_DEPTH_LEFTOPEN_RE = re.compile(r"^\s*~\s*(\d+(?:\.\d+)?)")                  # ~b
+_DEPTH_SINGLE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:mm|ミリ|ﾐﾘ)?\b", re.IGNORECASE)
+_DEPTH_SORT_RE = re.compile(r"(\d+(?:\.\d+)?)(?:-(\d+(?:\.\d+)?))?")
+
 def _normalize_depth_str(v: Optional[str]) -> Optional[str]:
     if v is None:
         return None
     s = str(v).strip()
     if not s:
         return None
-    # 全角→半角（辞書版：1:1 マッピング）
-    z2h = str.maketrans({
-        "－": "-", "ー": "-",  # 長音もハイフン扱い（保険）
-        "０": "0","１": "1","２": "2","３": "3","４": "4",
-        "５": "5","６": "6","７": "7","８": "8","９": "9",
-        "．": ".", "。": ".",  # 句点混入の保険
-        "〜": "~","～": "~",   # 波ダッシュを ~ に
-        "㎜": "mm",
-    })
-    s = s.translate(z2h).replace(" ", "")
-    # ハイフン/ダッシュ類を揃える → 最後に ~ は - 扱いへ
-    s = s.replace("–", "-").replace("—", "-").replace("―", "-").replace("‐", "-")
-    s = s.replace("~", "-")
+    # 全角→半角・ダッシュ/~ → "-"・空白除去を1パスで
+    s = s.translate(_DEPTH_Z2H_TABLE)
     # 単値なら mm を付与
-    if re.fullmatch(r"\d+(?:\.\d+)?", s):
+    if _DEPTH_NUM_ONLY_RE.fullmatch(s):
         s = s + "mm"
     # "mm" を小文字に揃える
-    s = re.sub(r"(?<=\d)\s*mm$", "mm", s, flags=re.I)
+    s = _DEPTH_MM_TAIL_RE.sub("mm", s)
     return s
 
 def _parse_depth_range_cell(cell: str) -> Optional[Tuple[float, float]]:
     if not cell:
         return None
-    t = (cell.replace("㎜", "mm")
-              .replace("〜", "~").replace("～", "~")
-              .replace("–", "-").replace("—", "-").replace("―", "-").replace("‐", "-").replace("−", "-"))
+    t = cell.translate(_DEPTH_CELL_TABLE)
     # a-b
-    m = re.search(r"(\d+(?:\.\d+)?)\s*[-~]\s*(\d+(?:\.\d+)?)", t)
+    m = _DEPTH_RANGE_RE.search(t)
     if m:
         lo = float(m.group(1)); hi = float(m.group(2))
         if lo > hi:
             lo, hi = hi, lo
         return (lo, hi)
     # ~b （0-b と解釈）
-    m = re.search(r"^\s*~\s*(\d+(?:\.\d+)?)", t)
+    m = _DEPTH_LEFTOPEN_RE.search(t)
     if m:
         hi = float(m.group(1))
         return (0.0, hi)
     # 単値
-    m = re.search(r"(\d+(?:\.\d+)?)\s*(?:mm|ミリ|ﾐﾘ)?\b", t, re.IGNORECASE)
+    m = _DEPTH_SINGLE_RE.search(t)
     if m:
         v = float(m.group(1))
         return (v, v)
@@ -251,7 +289,7 @@ def _depth_candidates_from_df(df: pd.DataFrame, limit: int = 8) -> List[str]:
                 vals.add(n)
     # 数値下限でソート（レンジは下限→幅）
     def keyfun(x: str):
-        m = re.match(r"(\d+(?:\.\d+)?)(?:-(\d+(?:\.\d+)?))?", x)
+        m = _DEPTH_SORT_RE.match(x)
         if m:
             lo = float(m.group(1))
             hi = float(m.group(2)) if m.group(2) else lo
@@ -332,8 +370,11 @@ SESSIONS: Dict[str, SearchSession] = {}
 def get_session(user_key: str) -> SearchSession:
     sess = SESSIONS.get(user_key)
     if not sess:
-        sess = SearchSession()
-        SESSIONS[user_key] = sess
+        # ハンドラはスレッドプールで並行実行されるため setdefault で登録を1回に
+        new = SearchSession()
+        # ユーザー単位のロック。reset()（__init__ 再実行）で差し替わらないようここで付ける
+        new.lock = threading.Lock()
+        sess = SESSIONS.setdefault(user_key, new)
     return sess
 
 # =============================
@@ -551,6 +592,11 @@ def _do_search_and_maybe_refine(sess: SearchSession, used_optional: Optional[str
 # =============================
 def handle_text(user_key: str, text: str) -> Dict[str, object]:
     sess = get_session(user_key)
+    # 同じユーザーの連続メッセージが並行に走っても stage/filters/last_results の読み書きが混ざらないよう1件ずつ処理
+    with sess.lock:
+        return _handle_text(sess, user_key, text)
+
+def _handle_text(sess: SearchSession, user_key: str, text: str) -> Dict[str, object]:
     t = (text or "").strip()
 
     if t.lower() in ("id", "uid") or t in ("ユーザーid", "ユーザid"):
@@ -869,12 +915,43 @@ async def dev_run(req: Request):
     if t.lower() in ("id", "uid") or t in ("ユーザーid", "ユーザid"):
         return UTF8JSONResponse({"text": f"(dev) your user_id: {user_id}", "quick": []})
 
-    out = handle_text(user_id, text)
+    # pandas 検索は同期処理なのでイベントループを塞がないようスレッドで実行
+    out = await run_in_threadpool(handle_text, user_id, text)
     return UTF8JSONResponse(out)
 
 # ====== LINE Webhook ======
 if LINE_AVAILABLE and CHANNEL_ACCESS_TOKEN and CHANNEL_SECRET:
-    line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
+    # reply_message ごとに requests.post（毎回 TCP/TLS ハンドシェイク）にならないよう、
+    # プロセス共有の keep-alive Session で LINE API へ接続する（スレッドプールから同時利用される）
+    _LINE_SESSION = requests.Session()
+    _LINE_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=40))
+
+    class _SessionHttpClient(RequestsHttpClient):
+        def get(self, url, headers=None, params=None, stream=False, timeout=None):
+            response = _LINE_SESSION.get(url, headers=headers, params=params, stream=stream,
+                                         timeout=self.timeout if timeout is None else timeout)
+            return RequestsHttpResponse(response)
+
+        def post(self, url, headers=None, data=None, timeout=None):
+            response = _LINE_SESSION.post(url, headers=headers, data=data,
+                                          timeout=self.timeout if timeout is None else timeout)
+            return RequestsHttpResponse(response)
+
+        def delete(self, url, headers=None, data=None, timeout=None):
+            response = _LINE_SESSION.delete(url, headers=headers, data=data,
+                                            timeout=self.timeout if timeout is None else timeout)
+            return RequestsHttpResponse(response)
+
+        def put(self, url, headers=None, data=None, timeout=None):
+            response = _LINE_SESSION.put(url, headers=headers, data=data,
+                                         timeout=self.timeout if timeout is None else timeout)
+            return RequestsHttpResponse(response)
+
+    @app.on_event("shutdown")
+    def _close_line_session():
+        _LINE_SESSION.close()
+
+    line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN, http_client=_SessionHttpClient)
     handler = WebhookHandler(CHANNEL_SECRET)
 
     @app.post("/callback")
@@ -890,7 +967,9 @@ if LINE_AVAILABLE and CHANNEL_ACCESS_TOKEN and CHANNEL_SECRET:
 
         signature = request.headers.get("X-Line-Signature", "")
         try:
-            handler.handle(body_text, signature)
+            # 検索（pandas）と reply_message（同期HTTP）はイベントループ外で実行し、
+            # 返信の往復待ちの間も他の Webhook を受け付けられるようにする
+            await run_in_threadpool(handler.handle, body_text, signature)
         except InvalidSignatureError:
             return PlainTextResponse("Invalid signature", status_code=400)
         return PlainTextResponse("OK")
@@ -1,4 +1,5 @@
-from typing import List, Dict, Any, Tuple
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Optional
 
 # ---- 内部ヘルパ -------------------------------------------------
 
@@ -11,16 +12,43 @@ def _eff_norm(mark: str) -> str:
     return (mark or "").replace("〇", "○")
 
 def _count_by_eff(rows: List[dict]) -> Tuple[int, int, int]:
-    g = s = w = 0  # ◎, ○, △
-    for r in rows:
-        m = _eff_norm(r.get("作業効率評価", ""))
-        if "◎" in m:
-            g += 1
-        elif "○" in m:
-            s += 1
-        elif "△" in m:
-            w += 1
-    return g, s, w
+    # 値の種類は少ないので先に値ごとに数え、記号判定（含む◎→○→△の優先順）は種類ごとに1回だけ
+    counts = [0, 0, 0]  # ◎, ○, △
+    for val, n in Counter(r.get("作業効率評価", "") for r in rows).items():
+        m = _eff_norm(val)
+        for i, mark in enumerate(("◎", "○", "△")):
+            if mark in m:
+                counts[i] += n
+                break
+    return counts[0], counts[1], counts[2]
+
+def _as_rows(results: Any, limit: Optional[int] = None) -> List[dict]:
+    """
+    List[dict] / pandas.DataFrame のどちらでも受け付ける（pandas は import しない）。
+    DataFrame は必要な行数だけ切り出してから 1 回で records 化する。
+    """
+    if results is None:
+        return []
+    if hasattr(results, "columns") and hasattr(results, "to_dict"):
+        if limit is not None:
+            results = results.iloc[:limit]
+        return results.to_dict("records")
+    return results if limit is None else results[:limit]
+
+def _view_fields(r: dict) -> Tuple[str, str, str, str, str, str, str]:
+    """
+    表示に使う列を1回で取り出す: (評価, 機種, カッター, 作業, 下地, 深さ, 工程数)
+    """
+    get = r.get
+    return (
+        _eff_norm(get("作業効率評価", "")),
+        get("ライナックス機種名", "") or "-",
+        get("使用カッター名", "") or "-",
+        get("作業名", "") or "-",
+        get("下地の状況", "") or "-",
+        get("処理する深さ・厚さ", "") or "-",
+        get("工程数", ""),
+    )
 
 def _humanize_query(query: Dict[str, Any]) -> List[str]:
     """
@@ -116,23 +144,16 @@ def _stage_hit_label(r: dict) -> str:
 # ---- 行レンダリング --------------------------------------------
 
 def _render_line(r: dict) -> str:
-    eff    = _eff_norm(r.get("作業効率評価", ""))
-    mech   = r.get("ライナックス機種名", "") or "-"
-    cutter = r.get("使用カッター名", "") or "-"
-    job    = r.get("作業名", "") or "-"
-    sub    = r.get("下地の状況", "") or "-"
-    depth  = r.get("処理する深さ・厚さ", "") or "-"
-    steps  = r.get("工程数", "")
-
-    steps_sfx = f" / 工程: {steps}" if steps else ""
+    eff, mech, cutter, job, sub, depth, steps = _view_fields(r)
     stage_sfx = _stage_hit_label(r)
 
     # 例）◎ K-200ENV + ブロックチップⅡ | 作業 / 下地 / 0.5–1.0mm / 工程: 一次工程 （検索ヒットした工程）
-    return (
-        f"{eff or '・'} {mech} + {cutter} | "
-        f"{job} / {sub} / {depth}{steps_sfx}"
-        f"{(' ' + stage_sfx) if stage_sfx else ''}"
-    )
+    parts = [eff or "・", mech, "+", cutter, "|", job, "/", sub, "/", depth]
+    if steps:
+        parts += ("/", f"工程: {steps}")
+    if stage_sfx:
+        parts.append(stage_sfx)
+    return " ".join(parts)
 
 def _summary_line(rows: List[dict]) -> str:
     """
@@ -162,52 +183,47 @@ def to_plain_text(results: List[dict], query: Dict[str, Any], explain: str) -> s
       - 空行
       - 本文（並びは 単一→◎→○→△→空、ペア補完は _pair_candidate ではなく工程ラベルで表示）
       - 末尾に凡例・抽出条件サマリ・評価内訳
+    results は List[dict] のほか pandas.DataFrame もそのまま渡せる。
     """
-    ordered = _sort_for_view(results or [])
+    ordered = _sort_for_view(_as_rows(results))
     total = len(ordered)
 
-    header_results = f"＝＝＝検索結果＝＝＝{total}件"
-    summary_line = _summary_line(ordered) if total > 0 else "該当するレコードは見つかりませんでした。"
+    qlines = _humanize_query(query)
+    header_query = "🔎 抽出条件\n" + ("\n".join(f"・{ln}" for ln in qlines) if qlines else "・（特になし）")
+    legend = "※ 評価の意味: ◎=非常に適, ○=適, △=一部条件で可"
+
+    # 断片は1つのリストに積んで最後に1回だけ join する
+    parts = [f"＝＝＝検索結果＝＝＝{total}件", "\n"]
 
     if total == 0:
-        qlines = _humanize_query(query)
-        header_query = "🔎 抽出条件\n" + ("\n".join(f"・{ln}" for ln in qlines) if qlines else "・（特になし）")
-        legend = "※ 評価の意味: ◎=非常に適, ○=適, △=一部条件で可\n"
-        ex = f"（{explain}）" if explain else ""
-        return f"{header_results}\n{summary_line}\n\n{legend}{ex}\n\n{header_query}".strip()
+        parts += ("該当するレコードは見つかりませんでした。", "\n\n", legend, "\n")
+        if explain:
+            parts.append(f"（{explain}）")
+        parts += ("\n\n", header_query)
+        return "".join(parts).strip()
 
     SHOW_MAX = 30
-    shown = ordered[:SHOW_MAX]
-    lines = [_render_line(r) for r in shown]
-    more = f"\n…ほか {total - SHOW_MAX} 件" if total > SHOW_MAX else ""
-
-    qlines = _humanize_query(query)
-    header_query = "🔎 抽出条件\n" + ("\n".join(f"・{ln}" for ln in qlines) if qlines else "・（特になし）")
+    parts += (_summary_line(ordered), "\n\n")
+    parts.append("\n\n".join([_render_line(r) for r in ordered[:SHOW_MAX]]))
+    if total > SHOW_MAX:
+        parts.append(f"\n…ほか {total - SHOW_MAX} 件")
+    parts += ("\n\n", legend)
+    if explain:
+        parts.append(f"\n（{explain}）")
     g, s, w = _count_by_eff(ordered)
-    summary_tail = f"\n\n📊 内訳: ◎{g} / ○{s} / △{w}"
-    legend = "\n\n※ 評価の意味: ◎=非常に適, ○=適, △=一部条件で可"
-    ex = f"\n（{explain}）" if explain else ""
-
-    return (
-        f"{header_results}\n{summary_line}\n\n" + "\n\n".join(lines) + more +
-        legend + ex + "\n\n" + header_query + summary_tail
-    )
+    parts += ("\n\n", header_query, f"\n\n📊 内訳: ◎{g} / ○{s} / △{w}")
+    return "".join(parts)
 
 def to_flex_message(results: List[dict]) -> dict:
     """
     LINEのFlex Message用（上位10件）。
       - タイトル頭の「（ペア候補）」プレフィックスを廃止
       - 一次/二次工程なら本文の末尾にラベル（検索ヒット/ペア）を付与
+      - results は List[dict] / pandas.DataFrame のどちらでも可
     """
     bubbles = []
-    for r in (results or [])[:10]:
-        eff    = _eff_norm(r.get("作業効率評価",""))
-        mech   = r.get("ライナックス機種名","") or "-"
-        cutter = r.get("使用カッター名","") or "-"
-        job    = r.get("作業名","") or "-"
-        sub    = r.get("下地の状況","") or "-"
-        depth  = r.get("処理する深さ・厚さ","") or "-"
-        steps  = r.get("工程数","")
+    for r in _as_rows(results, limit=10):
+        eff, mech, cutter, job, sub, depth, steps = _view_fields(r)
 
         subtitle = f"{job} / {sub}"
         depth_line = f"{depth}"
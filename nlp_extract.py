@@ -19,6 +19,10 @@ try:
     import yaml
 except Exception: # pyyaml 無い場合でも起動は通す
     yaml = None
+try:
+    import ahocorasick  # pyahocorasick（任意。無ければ従来の部分一致ループ）
+except Exception:
+    ahocorasick = None
 
 _SYNONYM_MAP = {}
 
@@ -28,14 +32,21 @@ Path.cwd() / "synonyms.yaml",
 ]    
 
 from functools import lru_cache
-from typing import Dict, List, Tuple, Any, Optional, Set
-import pandas as pd
+from typing import TYPE_CHECKING, Dict, List, Tuple, Any, Optional, Set
+if TYPE_CHECKING:
+    import pandas as pd  # 実体は _df() で初めて import（ルール抽出だけなら読み込まない）
+
+import _csv_cache
 
 def _to_halfwidth(s: str) -> str:
     return unicodedata.normalize("NFKC", s)
 
+_HYPHEN_RE = re.compile(r"[‐‑‒–—―ー−﹣－]+")
+_WS_RE = re.compile(r"\s+")
+_LABEL_SPLIT_RE = re.compile(r"[,\s、]+")
+
 def _normalize_hyphen(s: str) -> str:
-    return re.sub(r"[‐‑‒–—―ー−﹣－]+", "-", s) # いろいろなダッシュを半角ハイフンへ
+    return _HYPHEN_RE.sub("-", s) # いろいろなダッシュを半角ハイフンへ
 
 def normalize_token(s: str) -> str:
     s = _to_halfwidth(s).strip()
@@ -132,7 +143,7 @@ def z2h(s: str) -> str:
 def normalize(s: str) -> str:
     t = z2h(s).strip()
     t = t.replace("ｍｍ", "mm").replace("ＭＭ", "mm")
-    t = re.sub(r"\s+", " ", t)
+    t = _WS_RE.sub(" ", t)
     return t
 
 _JA_TRAILING_PARTICLES = set("をにはがへとでもや")
@@ -154,10 +165,11 @@ def _df() -> pd.DataFrame:
     ]
     for p in filter(None, cands):
         if os.path.exists(p):
-            df = pd.read_csv(p, dtype=str, encoding="utf-8-sig", keep_default_na=False)
+            df = _csv_cache.read_frame(p).copy()  # 共有キャッシュは書き換えない
             for c in df.columns:
                 df[c] = df[c].apply(lambda x: normalize(x) if isinstance(x, str) else x)
             return df
+    import pandas as pd
     return pd.DataFrame(columns=COLUMNS)
 
 @lru_cache(maxsize=1)
@@ -170,7 +182,7 @@ def _labels_by_col() -> Dict[str, List[str]]:
             continue
         uniq = set()
         for raw in df[col].astype(str).tolist():
-            for part in [p.strip() for p in re.split(r"[,\s、]+", raw) if p.strip()]:
+            for part in [p.strip() for p in _LABEL_SPLIT_RE.split(raw) if p.strip()]:
                 uniq.add(part)
         labels[col] = sorted(uniq)
     return labels
@@ -219,7 +231,7 @@ def _load_synonyms() -> Dict[str, Dict[str, List[str]]]:
         if isinstance(val, list):
             return [normalize(str(w)) for w in val if str(w).strip()]
         s = normalize(str(val))
-        return [w for w in re.split(r"[,\s、]+", s) if w]
+        return [w for w in _LABEL_SPLIT_RE.split(s) if w]
 
     labels_by_col = _labels_by_col()
     from_yaml: Dict[str, Dict[str, List[str]]] = {}
@@ -297,37 +309,50 @@ _RE_DEPTH_SINGLE_MM = re.compile(
     rf"({_NUM})\s*(?:mm|ミリ|ﾐﾘ)(?![A-Za-z0-9])",
     re.IGNORECASE,
 )
-def extract_depth(text: str) -> Optional[Tuple[str, float, float] | Tuple[str, float]]:
+_RE_DEPTH_NUM = re.compile(rf"\b({_NUM})\b")
+
+_DepthInfo = Optional[Tuple[str, float, float] | Tuple[str, float]]
+
+@lru_cache(maxsize=256)
+def _scan_depth(text: str) -> Tuple[_DepthInfo, Tuple[float, ...]]:
+    """
+    1回の正規化で深さ情報をまとめて取る。
+    戻り: (extract_depth 相当の構造化結果, 出現順・重複なしの数値列)
+    """
     t = normalize(text)
+    nums = tuple(dict.fromkeys(float(x) for x in _RE_DEPTH_NUM.findall(t)))
     m = _RE_DEPTH_RANGE.search(t)
     if m:
         lo = float(m.group(1)); hi = float(m.group(2))
         if lo > hi: lo, hi = hi, lo
-        return ('range', lo, hi)
+        return ('range', lo, hi), nums
     m = _RE_DEPTH_SINGLE_MM.search(t)
     if m:
         v = float(m.group(1))
-        return ('single', v)
-    return None
+        return ('single', v), nums
+    return None, nums
+
+def extract_depth(text: str) -> _DepthInfo:
+    return _scan_depth(text)[0]
 
 def _extract_depth_numbers(text: str) -> List[float]:
-    t = normalize(text)
-    nums: List[float] = []
-    for m in re.finditer(rf"\b({_NUM})\b", t):
-        try: nums.append(float(m.group(1)))
-        except: pass
-    out: List[float] = []
-    for v in nums:
-        if v not in out: out.append(v)
-    return out
+    return list(_scan_depth(text)[1])
 
 # ------------------------------
 # トークナイズ
 # ------------------------------
+_TOK_RE = re.compile(r"[A-Za-z0-9\.\-\+%]+|[\u3040-\u30FF\u4E00-\u9FFF]+|[^\s]")
+
 def _tokenize_ja(text: str) -> List[str]:
     t = normalize(text)
-    toks = re.findall(r"[A-Za-z0-9\.\-\+%]+|[\u3040-\u30FF\u4E00-\u9FFF]+|[^\s]", t)
-    return [tok for tok in toks if tok.strip()]
+    return [tok for tok in _TOK_RE.findall(t) if tok.strip()]
+
+@lru_cache(maxsize=256)
+def _tokenize_ja_set(text: str) -> frozenset:
+    """
+    literal 補完の照合用：末尾助詞を落として正規化したトークン集合
+    """
+    return frozenset(normalize(_strip_trailing_particle(tok)) for tok in _tokenize_ja(text))
 
 # ------------------------------
 # CSV 既存ラベルへの寄せ
@@ -346,25 +371,68 @@ def _canonicalize_label(col: str, label: str) -> str:
 # alias を全文から収集（全カラム）
 # 戻り: { alias_key: [(col, canonical_label), ...] }
 # ------------------------------
+@lru_cache(maxsize=1)
+def _alias_entries() -> Tuple[Tuple[str, str, Tuple[str, ...]], ...]:
+    """
+    alias 照合用に (正規化済みalias, col, canonical_labels) を列→alias の順で平坦化。
+    alias の normalize はここで1回だけ行う。
+    """
+    entries: List[Tuple[str, str, Tuple[str, ...]]] = []
+    for col, idx in _compile_alias_index().items():
+        for alias_key, canon_list in idx.items():
+            ak = normalize(alias_key)
+            if ak:
+                entries.append((ak, col, tuple(canon_list)))
+    return tuple(entries)
+
+@lru_cache(maxsize=1)
+def _alias_automaton():
+    """
+    全 alias を1つの Aho–Corasick オートマトンにまとめる（pyahocorasick が無ければ None）。
+    """
+    if ahocorasick is None:
+        return None
+    A = ahocorasick.Automaton()
+    for ak, _, _ in _alias_entries():
+        A.add_word(ak, ak)
+    if len(A) == 0:
+        return None
+    A.make_automaton()
+    return A
+
+def _aliases_in(*texts: str) -> Set[str]:
+    """
+    texts のいずれかに部分文字列として含まれる alias の集合。
+    オートマトンがあれば各テキスト1パス、無ければ alias ごとの `in` 判定。
+    """
+    A = _alias_automaton()
+    if A is not None:
+        return {ak for t in texts for _, ak in A.iter(t)}
+    return {ak for ak, _, _ in _alias_entries() if any(ak in t for t in texts)}
+
 def _gather_alias_hits_all_cols(text: str) -> Dict[str, List[Tuple[str, str]]]:
-    idx_all = _compile_alias_index()
     t = normalize(text)
     t2 = normalize(_strip_trailing_particle(text))
+    found = _aliases_in(t, t2)
     hits: Dict[str, List[Tuple[str, str]]] = {}
-    for col, idx in idx_all.items():
-        for alias_key, canon_list in idx.items():
-            ak = normalize(alias_key)
-            if not ak:
-                continue
-            if (ak in t) or (ak in t2):
-                for canonical in canon_list:
-                    hits.setdefault(ak, []).append((col, canonical))
+    if not found:
+        return hits
+    # 並び順（列→alias）は従来どおり維持
+    for ak, col, canon_list in _alias_entries():
+        if ak in found:
+            for canonical in canon_list:
+                hits.setdefault(ak, []).append((col, canonical))
     return hits
 
+def _winner_col(cand_list: List[Tuple[str, str]]) -> str:
+    # 列優先度が最も強い列（同順位なら先勝ち）。全体ソートはせず min で1パス
+    return min(cand_list, key=lambda x: _PRIO.get(x[0], 9999))[0]
+
 # ------------------------------
 # CSV 補完（モード切替）
 # ------------------------------
-def _csv_only_match_labels(col: str, tokens: List[str], consumed_alias: Set[str]) -> List[str]:
+def _csv_only_match_labels(col: str, tokens: List[str], consumed_alias: Set[str],
+                           token_set: Optional[frozenset] = None) -> List[str]:
     mode = CSV_COMPLETION_MODE
     if mode == "off":
         return []
@@ -372,7 +440,7 @@ def _csv_only_match_labels(col: str, tokens: List[str], consumed_alias: Set[str]
     if not labels:
         return []
     if mode == "literal":
-        tset = {normalize(_strip_trailing_particle(tok)) for tok in tokens}
+        tset = token_set if token_set is not None else {normalize(_strip_trailing_particle(tok)) for tok in tokens}
         return [lb for lb in labels if normalize(lb) in tset]
     # partial（従来の補完）
     hits: List[str] = []
@@ -434,8 +502,7 @@ def find_canon_labels(text: str) -> Set[str]:
     consumed_alias: Set[str] = set()
     out: Set[str] = set()
     for ak, cand_list in alias_hits.items():
-        cand_list.sort(key=lambda x: _PRIO.get(x[0], 9999))
-        win_col = cand_list[0][0]
+        win_col = _winner_col(cand_list)
         consumed_alias.add(ak)
         for col, label in cand_list:
             if col == win_col and col == "作業名":
@@ -449,7 +516,7 @@ def extract_query(text: str) -> Tuple[Dict[str, Any], str]:
     tokens = _tokenize_ja(text)
 
     # 深さ
-    depth_info = extract_depth(text)
+    depth_info, depth_nums = _scan_depth(text)
     depth_range: Optional[Tuple[float, float]] = None
     depth_value: Optional[float] = None
     depth_strs: List[str] = []
@@ -461,8 +528,7 @@ def extract_query(text: str) -> Tuple[Dict[str, Any], str]:
             _, v = depth_info
             depth_value = v; depth_strs = [f"{v:g}"]
     else:
-        nums = _extract_depth_numbers(text)
-        depth_strs = [f"{d:g}" for d in nums]
+        depth_strs = [f"{d:g}" for d in depth_nums]
 
     filters: Dict[str, Any] = {
         "作業名": [],
@@ -493,8 +559,7 @@ def extract_query(text: str) -> Tuple[Dict[str, Any], str]:
     consumed_alias: Set[str] = set()
 
     for ak, cand_list in alias_hits.items():
-        cand_list.sort(key=lambda x: _PRIO.get(x[0], 9999))
-        win_col = cand_list[0][0]
+        win_col = _winner_col(cand_list)
 
         # 下地の状況は、選択保留がある場合はここでの自動割当てを抑制
         if (win_col == "下地の状況") and (("_needs_choice" in filters) or resolved_sub):
@@ -511,10 +576,11 @@ def extract_query(text: str) -> Tuple[Dict[str, Any], str]:
         consumed_alias.add(ak)
 
     # --- 必要なら CSV 補完（モードに従う） ---
+    token_set = _tokenize_ja_set(text)
     for col in ["作業名", "下地の状況", "工程数", "機械カテゴリー", "ライナックス機種名", "使用カッター名", "作業効率評価"]:
         if filters[col]:
             continue
-        for h in _csv_only_match_labels(col, tokens, consumed_alias):
+        for h in _csv_only_match_labels(col, tokens, consumed_alias, token_set):
             h2 = _canonicalize_label(col, h)
             if h2 not in filters[col]:
                 filters[col].append(h2)
@@ -7,7 +7,12 @@
 # - 効率: ◎ > ○/〇 > △ （'〇' と '○' は同値）
 # - 重複は作業ID優先で除去
 from typing import List, Dict, Any, Tuple
-import os, csv
+from functools import lru_cache
+from collections import defaultdict
+import os
+import threading
+
+import _csv_cache
 
 EFF_RANK_MAP = {
     "◎": 3,
@@ -16,12 +21,14 @@ EFF_RANK_MAP = {
     "△": 1,
 }
 
+@lru_cache(maxsize=64)
 def eff_rank(val: str) -> int:
     v = (val or "").strip()
     return EFF_RANK_MAP.get(v, 0)
 
+@lru_cache(maxsize=256)
 def canon_stage(s: str) -> str:
-    """工程数の正規化: 単一/一次/二次 の3分類へ"""
+    """工程数の正規化: 単一/一次/二次 の3分類へ（値の種類が少ないので結果をキャッシュ）"""
     if not s:
         return ""
     t = str(s)
@@ -64,37 +71,58 @@ def _sort_key_eff(r: Dict[str, Any]) -> Tuple[int, str, str]:
             str(r.get("使用カッター名", "")))
 
 # ------------ CSV全体のグループ索引（一次/二次）を作る ------------
+def _new_bucket() -> Dict[str, List[Dict[str, Any]]]:
+    return {"一次": [], "二次": []}
+
 _ALL_GROUPS: Dict[Tuple[str, str, str], Dict[str, List[Dict[str, Any]]]] | None = None
+_ALL_GROUPS_KEY: Tuple[str, float] | None = None
+_GROUPS_LOCK = threading.Lock()
 
 def _read_csv_rows(path: str) -> List[Dict[str, Any]]:
-    # エンコーディングはUTF-8優先、失敗時にcp932を試す
-    for enc in ("utf-8", "utf-8-sig", "cp932"):
-        try:
-            with open(path, "r", encoding=enc, newline="") as f:
-                return list(csv.DictReader(f))
-        except Exception:
-            continue
-    return []
+    # 読み込み・エンコーディング判定は共有キャッシュ側（UTF-8優先、失敗時にcp932）
+    try:
+        return _csv_cache.read_rows(path)
+    except Exception:
+        return []
+
+def _groups_csv_path() -> str:
+    return os.environ.get("RAG_CSV_PATH", "./restructured_file.csv")
 
 def _build_all_groups() -> Dict[Tuple[str, str, str], Dict[str, List[Dict[str, Any]]]]:
-    path = os.environ.get("RAG_CSV_PATH", "./restructured_file.csv")
-    rows = _read_csv_rows(path)
-    groups: Dict[Tuple[str, str, str], Dict[str, List[Dict[str, Any]]]] = {}
+    rows = _read_csv_rows(_groups_csv_path())
+    # 既存キーでは空の {"一次": [], "二次": []} を作らない（setdefault は毎回作る）
+    groups: Dict[Tuple[str, str, str], Dict[str, List[Dict[str, Any]]]] = defaultdict(_new_bucket)
     for r in rows:
         stage = canon_stage(r.get("工程数", ""))
         if stage not in ("一次", "二次"):
             continue  # 単一はペア補完対象外
         key = _row_key_for_group(r)
-        bucket = groups.setdefault(key, {"一次": [], "二次": []})
-        bucket[stage].append(r)
-    return groups
+        groups[key][stage].append(r)
+    # 補完用のリストは効率順に並べ済みにしておく（クエリごとの sort を省く）
+    for bucket in groups.values():
+        bucket["一次"].sort(key=_sort_key_eff)
+        bucket["二次"].sort(key=_sort_key_eff)
+    return dict(groups)  # 参照側の [] で空グループが増えないよう通常の dict で返す
 
 def _get_all_groups():
-    global _ALL_GROUPS
-    if _ALL_GROUPS is None:
-        _ALL_GROUPS = _build_all_groups()
+    global _ALL_GROUPS, _ALL_GROUPS_KEY
+    try:
+        key = _csv_cache.file_key(_groups_csv_path())
+    except OSError:
+        key = None  # CSV 無し → 空の索引のまま
+    # CSV が差し替えられたら（mtime 変化）索引を作り直す。
+    # 同時に来た初回リクエストが二重に作らないよう、ロックして再確認（double-checked）
+    if _ALL_GROUPS is None or key != _ALL_GROUPS_KEY:
+        with _GROUPS_LOCK:
+            if _ALL_GROUPS is None or key != _ALL_GROUPS_KEY:
+                _ALL_GROUPS = _build_all_groups()
+                _ALL_GROUPS_KEY = key
     return _ALL_GROUPS
 
+def warm_groups() -> None:
+    """ペア補完の索引を先に作っておく（起動時のプリフェッチ用）。"""
+    _get_all_groups()
+
 # ------------ 並べ替え & ペア補完の本体 ------------
 def reorder_and_pair(rows: List[Dict[str, Any]],
                      query_text: str = "",
@@ -106,7 +134,7 @@ def reorder_and_pair(rows: List[Dict[str, Any]],
     all_groups = _get_all_groups()
 
     # 1) ヒット結果をグルーピング
-    groups_hit: Dict[Tuple[str, str, str], Dict[str, List[Dict[str, Any]]]] = {}
+    groups_hit: Dict[Tuple[str, str, str], Dict[str, List[Dict[str, Any]]]] = defaultdict(_new_bucket)
     singles_all: List[Dict[str, Any]] = []
     for r in rows:
         stage = canon_stage(r.get("工程数", ""))
@@ -114,7 +142,7 @@ def reorder_and_pair(rows: List[Dict[str, Any]],
             singles_all.append(r)
             continue
         key = _row_key_for_group(r)
-        bucket = groups_hit.setdefault(key, {"一次": [], "二次": []})
+        bucket = groups_hit[key]
         if stage == "一次":
             bucket["一次"].append(r)
         elif stage == "二次":
@@ -123,14 +151,15 @@ def reorder_and_pair(rows: List[Dict[str, Any]],
             singles_all.append(r)
 
     # 2) 欠けている工程を CSV 全体から補完（同一グループのみ）
-    for key, parts in list(groups_hit.items()):
+    #    補完リストは並べ済みなので共有参照のまま使う（書き換えないこと）
+    for key, parts in groups_hit.items():
         full = all_groups.get(key)
         if not full:
             continue
         if not parts["一次"] and full["一次"]:
-            parts["一次"].extend(full["一次"])
+            parts["一次"] = full["一次"]
         if not parts["二次"] and full["二次"]:
-            parts["二次"].extend(full["二次"])
+            parts["二次"] = full["二次"]
 
     # 3) 単一工程は効率順で並べ
     singles_all.sort(key=_sort_key_eff)
@@ -138,10 +167,11 @@ def reorder_and_pair(rows: List[Dict[str, Any]],
     # 4) ペア展開: 各グループで一次（全部,効率順）→二次（全部,効率順）
     paired_all: List[Dict[str, Any]] = []
     for key, parts in groups_hit.items():
-        primary = sorted(parts.get("一次", []), key=_sort_key_eff)
-        second  = sorted(parts.get("二次", []), key=_sort_key_eff)
-        paired_all.extend(primary)
-        paired_all.extend(second)
+        full = all_groups.get(key) or {}
+        for stage in ("一次", "二次"):
+            lst = parts[stage]
+            # 補完したリストはそのまま、ヒット行のリストだけ並べ替える
+            paired_all.extend(lst if lst is full.get(stage) else sorted(lst, key=_sort_key_eff))
 
     # 5) 連結 & 重複除去
     out: List[Dict[str, Any]] = []
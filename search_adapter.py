@@ -1,14 +1,19 @@
 # search_adapter.py — ver: resilient dynamic loader
-# - ver4_2_python_based_RAG_wo_GPT.py を動的ロード
+# - ver4_2_python_based_RAG_wo_GPT.py を通常モジュールとして import（sys.modules / .pyc を共有）
 # - 初回だけCSV等を読み込みキャッシュ
 # - input が str（自然文）/ dict（フィルタ）どちらでも検索実行
 # - postprocess が使うための _ensure_context を公開
 
 from __future__ import annotations
 import os
+import sys
+import threading
+import importlib
 import importlib.util
 from typing import Dict, List, Tuple, Any, Optional
 
+import _csv_cache
+
 # === 設定 ===
 SEARCH_SCRIPT_PATH = os.environ.get(
     "SEARCH_SCRIPT_PATH",
@@ -18,6 +23,9 @@ CSV_PATH_ENV = os.environ.get("RAG_CSV_PATH")
 
 _mod = None  # type: Optional[Any]
 _ctx = None  # type: Optional[Tuple[Any, Any, Any, Any, Any]]
+_ctx_key = None  # type: Optional[Tuple[str, float]]  # _ctx を作ったときの CSV (path, mtime)
+_MOD_LOCK = threading.Lock()
+_CTX_LOCK = threading.Lock()
 
 __all__ = [
     "natural_text_to_filters",
@@ -29,9 +37,41 @@ __all__ = [
 
 def reset_cache() -> None:
     """テスト/リロード用：動的ロード済みモジュールとデータキャッシュを破棄"""
-    global _mod, _ctx
+    global _mod, _ctx, _ctx_key
     _mod = None
     _ctx = None
+    _ctx_key = None
+
+def _import_script(path: str):
+    """
+    スクリプトを通常のモジュールとして import する。
+    - ファイル名がモジュール名として有効で sys.path 上にあれば importlib.import_module（.pyc・sys.modules を共有）
+    - そうでなければファイルパスから読み込み、sys.modules に登録（プロセス内で二重実行しない）
+    """
+    path = os.path.abspath(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    if not name.isidentifier():
+        name = "user_rag_module"
+
+    mod = sys.modules.get(name)
+    if mod is not None and os.path.abspath(getattr(mod, "__file__", "") or "") == path:
+        return mod
+
+    found = importlib.util.find_spec(name) if name != "user_rag_module" else None
+    if found is not None and found.origin and os.path.abspath(found.origin) == path:
+        return importlib.import_module(name)
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"spec 作成に失敗: {path}")
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[name] = mod
+    try:
+        spec.loader.exec_module(mod)
+    except Exception:
+        sys.modules.pop(name, None)
+        raise
+    return mod
 
 def _load_user_module():
     """
@@ -43,15 +83,17 @@ def _load_user_module():
     global _mod
     if _mod is not None:
         return _mod
+    # 同時に来た初回リクエストがスクリプトを二重に実行しないよう、ロックして再確認（double-checked）
+    with _MOD_LOCK:
+        if _mod is None:
+            _mod = _import_and_validate()
+    return _mod
 
+def _import_and_validate():
     if not os.path.exists(SEARCH_SCRIPT_PATH):
         raise FileNotFoundError(f"ユーザー検索スクリプトが見つかりません: {SEARCH_SCRIPT_PATH}")
 
-    spec = importlib.util.spec_from_file_location("user_rag_module", SEARCH_SCRIPT_PATH)
-    if spec is None or spec.loader is None:
-        raise ImportError(f"spec 作成に失敗: {SEARCH_SCRIPT_PATH}")
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
+    mod = _import_script(SEARCH_SCRIPT_PATH)
 
     # 期待する属性/関数の存在を軽く確認
     required = [
@@ -74,7 +116,6 @@ def _load_user_module():
         else:
             mod.CSV_PATH = CSV_PATH_ENV  # 無ければ作る
 
-    _mod = mod
     return mod
 
 def _ensure_context():
@@ -83,20 +124,35 @@ def _ensure_context():
     以後はキャッシュを使う。
     戻り値: (raw_df, norm_df, uniq, known_keywords, synonym_dict)
     """
-    global _ctx
-    if _ctx is not None:
+    global _ctx, _ctx_key
+    mod = _load_user_module()
+    path = getattr(mod, "CSV_PATH", None)
+    try:
+        key = _csv_cache.file_key(path) if path else None
+    except OSError:
+        key = None
+    # CSV が差し替えられていなければ（mtime 同じ）キャッシュを返す
+    if _ctx is not None and key == _ctx_key:
         return _ctx
+    # 構築（CSV パース＋辞書作成）は重いので、同時の初回アクセスでも1回だけにする
+    with _CTX_LOCK:
+        if _ctx is None or key != _ctx_key:
+            _ctx = _build_context(mod, path)
+            _ctx_key = key  # _ctx を先に差し替える（キー一致を見た読み手が古い _ctx を掴まないように）
+    return _ctx
 
-    mod = _load_user_module()
-    raw_df, norm_df = mod.load_data(getattr(mod, "CSV_PATH", None))
+def _build_context(mod, path):
+    if hasattr(mod, "load_context"):
+        # CSV 横の pickle キャッシュ付き（プロセス再起動後も正規化・類義語構築をやり直さない）
+        return tuple(mod.load_context(path))
+    raw_df, norm_df = mod.load_data(path)
     uniq = mod.build_unique_dict(norm_df)
     known_keywords = mod.build_known_keywords(raw_df)
     synonym_dict = mod.build_auto_synonyms(
         norm_df,
         ["作業名", "下地の状況", "処理する深さ・厚さ", "ライナックス機種名", "使用カッター名", "工程数"],
     )
-    _ctx = (raw_df, norm_df, uniq, known_keywords, synonym_dict)
-    return _ctx
+    return (raw_df, norm_df, uniq, known_keywords, synonym_dict)
 
 def natural_text_to_filters(user_text: str) -> Dict[str, List[str]]:
     """
@@ -116,8 +172,9 @@ def run_query_with_filters(filters: Dict[str, List[str]]):
     """
     mod = _load_user_module()
     raw_df, norm_df, *_ = _ensure_context()
-    hits_norm = mod.filter_data(norm_df, filters)
-    hits_raw = raw_df.loc[hits_norm.index]
+    filter_index = getattr(mod, "filter_index", None)  # 無い旧スクリプトは filter_data の結果から index を取る
+    idx = filter_index(norm_df, filters) if filter_index is not None else mod.filter_data(norm_df, filters).index
+    hits_raw = raw_df.loc[idx]
     return hits_raw
 
 def run_query_system(input_query: Any):
@@ -3,12 +3,19 @@
 from __future__ import annotations
 
 import os
-import csv
 import re
+import threading
+import weakref
 from pathlib import Path
-from typing import Dict, List, Any, Tuple, Optional
+from typing import Callable, Dict, List, Any, Tuple, Optional, Sequence
 from dataclasses import dataclass, field
 from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import _csv_cache
 
 # ==============================
 # 定数・データクラス
@@ -26,6 +33,45 @@ class SearchOutcome:
     raw_hits: Optional[List[Dict[str, Any]]] = field(default=None)  # need_refine で利用
     depth_candidates: Optional[List[str]] = None  # 追加: 絞り込み候補（深さ/厚さ）
 
+@dataclass(slots=True)
+class QuerySpec:
+    """
+    run_query_system 内部で使うクエリ表現。
+    入口で dict から1回だけ変換し、行ごとの判定では dict.get ではなく属性参照で読む。
+    """
+    下地の状況: Tuple[str, ...] = ()
+    作業名: Tuple[str, ...] = ()
+    機械カテゴリー: Tuple[str, ...] = ()
+    ライナックス機種名: Tuple[str, ...] = ()
+    使用カッター名: Tuple[str, ...] = ()
+    工程数: Tuple[str, ...] = ()
+    作業効率評価: Tuple[str, ...] = ()
+    depth_range: Optional[Tuple[float, float]] = None
+    depth_value: Optional[float] = None
+    depth_strings: Tuple[str, ...] = ()  # 旧互換 "処理する深さ・厚さ"
+    stage_norms: frozenset = frozenset()  # 工程フィルタの正規化済み集合（_hit_stage 用）
+
+    @classmethod
+    def from_dict(cls, q: Dict[str, Any], ignore_depth: bool = False) -> "QuerySpec":
+        """ignore_depth=True で深さ条件（depth_range / depth_value / 旧互換の list）を外した形にする（dict はコピーしない）"""
+        stages = tuple(q.get("工程数") or ())
+        legacy = q.get("処理する深さ・厚さ")
+        if ignore_depth and isinstance(legacy, list):
+            legacy = None
+        return cls(
+            下地の状況=tuple(q.get("下地の状況") or ()),
+            作業名=tuple(q.get("作業名") or ()),
+            機械カテゴリー=tuple(q.get("機械カテゴリー") or ()),
+            ライナックス機種名=tuple(q.get("ライナックス機種名") or ()),
+            使用カッター名=tuple(q.get("使用カッター名") or ()),
+            工程数=stages,
+            作業効率評価=tuple(q.get("作業効率評価") or ()),
+            depth_range=None if ignore_depth else q.get("depth_range"),
+            depth_value=None if ignore_depth else q.get("depth_value"),
+            depth_strings=tuple(legacy or ()),
+            stage_norms=_want_stage_norms(stages),
+        )
+
 # ==============================
 # パス・CSVロード
 # ==============================
@@ -43,55 +89,137 @@ def _csv_path() -> str:
         return "restructured_file.csv"
     raise FileNotFoundError("restructured_file.csv が見つかりません。環境変数 RAG_CSV_PATH を設定してください。")
 
-def _load_rows() -> List[Dict[str, str]]:
-    path = _csv_path()
-    rows: List[Dict[str, str]] = []
-    with open(path, "r", encoding="utf-8-sig", newline="") as f:
-        for row in csv.DictReader(f):
-            rows.append(row)
-    return rows
+# 文字列マッチ対象の列（各キーは AND、値配列は OR）
+_MATCH_COLS = ("下地の状況", "作業名", "機械カテゴリー", "ライナックス機種名",
+               "使用カッター名", "工程数", "作業効率評価")
+_DEPTH_COL = "処理する深さ・厚さ"
+
+@dataclass
+class _Table:
+    """
+    CSV を1回だけ読み、クエリ間で使い回す検索用テーブル（列ごとに保持）。
+    - key:      作成元 CSV の (path, mtime)。クエリ結果キャッシュのキーに使う
+    - columns / values: 列名と行ごとの値タプル（行 dict はヒット時にだけ作る）
+    - postings: 列ごとの転置索引 {正規化トークン: 行番号の昇順配列}（トークン=セル全体 or 区切り要素の正規化値）
+    - depth_lo / depth_hi: 深さレンジ（解釈できない行は NaN）
+    - lo_order / lo_sorted: depth_lo 昇順の行番号とその値（NaN は末尾）。深さだけの問い合わせで二分探索に使う
+    - depth_bounds: 全行の (最小 lo, 最大 hi)。深さを解釈できる行が無ければ None
+    - stage:    行ごとの工程正規化値（'SINGLE' / 'A' / 'B' / None）
+    - order:    既定の並び（_sort_key）を1つの整数にした行ごとの順位キー
+    """
+    key: Tuple[str, float]
+    columns: Tuple[str, ...]
+    values: List[Tuple[str, ...]]
+    postings: Dict[str, Dict[str, np.ndarray]]
+    depth_lo: np.ndarray
+    depth_hi: np.ndarray
+    lo_order: np.ndarray
+    lo_sorted: np.ndarray
+    depth_bounds: Optional[Tuple[float, float]]
+    stage: List[Optional[str]]
+    order: np.ndarray
+
+    def row(self, i: int) -> Dict[str, str]:
+        """i 行目を新しい dict で返す（呼び出し側で書き換えてよい）"""
+        return dict(zip(self.columns, self.values[i]))
+
+@lru_cache(maxsize=1)
+def _load_table_at(key: Tuple[str, float]) -> _Table:
+    df = _csv_cache.read_frame(key[0])
+    empty = pd.Series("", index=df.index)
+
+    postings: Dict[str, Dict[str, np.ndarray]] = {}
+    for col in _MATCH_COLS:
+        cells = df[col] if col in df.columns else empty
+        post: Dict[str, List[int]] = defaultdict(list)
+        for i, v in enumerate(cells):
+            for tok in _cell_tokens(v):
+                post[tok].append(i)  # i は増加順に入るので配列は昇順
+        postings[col] = {tok: np.array(ix, dtype=np.intp) for tok, ix in post.items()}
+
+    depth_cells = df[_DEPTH_COL] if _DEPTH_COL in df.columns else empty
+    rngs = [_parse_depth_range(v) for v in depth_cells]
+    depth_lo = np.array([r[0] if r else np.nan for r in rngs], dtype=float)
+    depth_hi = np.array([r[1] if r else np.nan for r in rngs], dtype=float)
+    lo_order = np.argsort(depth_lo, kind="stable")  # NaN は末尾に並ぶ
+    parsed = ~np.isnan(depth_lo)
+    depth_bounds = (float(depth_lo[parsed].min()), float(depth_hi[parsed].max())) if parsed.any() else None
+
+    stage_cells = df["工程数"] if "工程数" in df.columns else empty
+    eff_cells = df["作業効率評価"] if "作業効率評価" in df.columns else empty
+    # _sort_key の (k_eng, k_eff) を k_eng*10 + k_eff に（k_eff は 0..9）
+    order = np.array([k_eng * 10 + k_eff for k_eng, k_eff in
+                      (_sort_key_of(st, ef) for st, ef in zip(stage_cells, eff_cells))],
+                     dtype=np.int64)
+    return _Table(
+        key=key,
+        columns=tuple(df.columns),
+        values=list(df.itertuples(index=False, name=None)),
+        postings=postings,
+        depth_lo=depth_lo,
+        depth_hi=depth_hi,
+        lo_order=lo_order,
+        lo_sorted=depth_lo[lo_order],
+        depth_bounds=depth_bounds,
+        stage=[_normalize_stage(v) for v in stage_cells],
+        order=order,
+    )
+
+_TABLE_LOCK = threading.Lock()
+
+def _load_table() -> _Table:
+    # CSV が差し替えられたら mtime が変わるので作り直す（同時の初回アクセスでも構築は1回）
+    key = _csv_cache.file_key(_csv_path())
+    with _TABLE_LOCK:
+        return _load_table_at(key)
 
 # ==============================
 # 正規化・深さユーティリティ
 # ==============================
 # 数値抽出（小数対応）
 _NUM_RE = re.compile(r"(\d+(?:\.\d+)?)")
-
+# 行ごとに呼ばれるパターンはすべてここで1回だけコンパイルしておく
+_RANGE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*[-~]\s*(\d+(?:\.\d+)?)")   # a-b / a~b
+_LEFTOPEN_RE = re.compile(r"^\s*~\s*(\d+(?:\.\d+)?)")                  # ~b
+_SINGLE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:mm|ミリ|ﾐﾘ)?\b", re.IGNORECASE)
+_DEPTH_PREFIX_RE = re.compile(r"^(処理する深さ・厚さ|処理深さ|厚さ)\s*[:：]?\s*")
+_BARE_NUM_RE = re.compile(r"\d+(?:\.\d+)?")
+_MM_TAIL_RE = re.compile(r"(?<=\d)\s*mm$", re.I)
+_DEPTH_SORT_RE = re.compile(r"(\d+(?:\.\d+)?)(?:-(\d+(?:\.\d+)?))?")
+_SEP_SPLIT_RE = re.compile(r"[、,]")
+
+# _canon_text 用: 全角カッコ→半角、ダッシュ/ハイフン類と空白（str.isspace の全文字）は削除
+_CANON_TABLE = str.maketrans({
+    "（": "(", "）": ")",
+    **{c: None for c in "‐-‒–—―−-"},
+    **{c: None for c in map(chr, range(0x3001)) if c.isspace()},  # 空白は U+3000 以下に収まる
+})
+# _parse_depth_range 用: ㎜→mm、波ダッシュ→~、各種ダッシュ→-
+_RANGE_NORM_TABLE = str.maketrans({
+    "㎜": "mm",
+    "〜": "~", "～": "~",
+    **{c: "-" for c in "–—―‐−"},
+})
+
+@lru_cache(maxsize=4096, typed=True)  # 1 と 1.0 / True を別キーに
 def _canon_text(s: str) -> str:
     """
-    比較用に正規化：全角→半角, 全角カッコ→半角, 全角空白→半角, ダッシュ/マイナス/ハイフン類・空白を除去,
+    比較用に正規化：全角カッコ→半角, ダッシュ/マイナス/ハイフン類・空白を除去,
     大文字小文字を同一視。→ Pg600 と Pg-600 の揺れを吸収。
     """
     if s is None:
         return ""
-    t = str(s)
-    # 全角→半角のざっくり
-    t = t.translate(str.maketrans({"（": "(", "）": ")", "　": " "}))
-    # ダッシュ/ハイフン類は除去（記号差を吸収）
-    t = t.translate(str.maketrans({c: "" for c in "‐-‒–—―−-"}))
-    # 空白除去
-    t = re.sub(r"\s+", "", t)
-    # 統一のため小文字化
-    t = t.lower()
-    return t
+    return str(s).translate(_CANON_TABLE).lower()
 
+@lru_cache(maxsize=4096, typed=True)  # 1 と 1.0 / True を別キーに
 def _to_mm_value(s: str) -> Optional[float]:
     """
     '1', '1.0', '1mm', '１㎜', '1 ミリ' などを float(mm) に。
-    失敗時 None。
+    失敗時 None。（単位表記は先頭の数値抽出に影響しないので置換しない。\d は全角数字にも一致）
     """
     if s is None:
         return None
-    t = str(s)
-    t = (
-        t.replace("㎜", "mm")
-         .replace("ＭＭ", "mm")
-         .replace("ｍｍ", "mm")
-         .replace("ｍ", "m")
-         .replace("〜", "-").replace("～", "-")
-         .replace("–", "-").replace("—", "-").replace("―", "-").replace("‐", "-").replace("−", "-")
-    )
-    m = _NUM_RE.search(t)
+    m = _NUM_RE.search(str(s))
     if not m:
         return None
     try:
@@ -99,41 +227,35 @@ def _to_mm_value(s: str) -> Optional[float]:
     except ValueError:
         return None
 
+@lru_cache(maxsize=4096)
 def _parse_depth_range(cell: str) -> Optional[Tuple[float, float]]:
     """
     行側の '0.4-1.0mm' / '0.5～1.0㎜' / '~7mm' / '3mm' などを (lo, hi) に。
     """
     if not cell:
         return None
-    raw = str(cell)
-    t = (
-        raw.replace("㎜", "mm")
-           .replace("〜", "~").replace("～", "~")
-           .replace("–", "-").replace("—", "-").replace("―", "-").replace("‐", "-").replace("−", "-")
-    )
+    t = str(cell).translate(_RANGE_NORM_TABLE)
     # 1) 範囲 a-b / a~b
-    m = re.search(r"(\d+(?:\.\d+)?)\s*[-~]\s*(\d+(?:\.\d+)?)", t)
+    m = _RANGE_RE.search(t)
     if m:
         lo = float(m.group(1)); hi = float(m.group(2))
         if lo > hi:
             lo, hi = hi, lo
         return (lo, hi)
     # 2) 左開区間 ~b
-    m = re.search(r"^\s*~\s*(\d+(?:\.\d+)?)", t)
+    m = _LEFTOPEN_RE.search(t)
     if m:
         hi = float(m.group(1))
         return (0.0, hi)
     # 3) 単発
-    m = re.search(r"(\d+(?:\.\d+)?)\s*(?:mm|ミリ|ﾐﾘ)?\b", t, re.IGNORECASE)
+    m = _SINGLE_RE.search(t)
     if m:
         v = float(m.group(1))
         return (v, v)
     return None
 
-def _range_overlap(a: Tuple[float, float], b: Tuple[float, float]) -> bool:
-    return not (a[1] < b[0] or b[1] < a[0])
-
 # --- 追加：工程正規化と深さ候補抽出 ---
+@lru_cache(maxsize=4096)
 def _normalize_stage(raw: Optional[str]) -> Optional[str]:
     """
     行/条件の工程表現を 'SINGLE' / 'A' / 'B' に正規化。
@@ -154,30 +276,36 @@ def _normalize_stage(raw: Optional[str]) -> Optional[str]:
         return "B"
     return None
 
+# 深さ表示用の全角→半角 + 区切り統一（〜/～/~/– → -）+ 半角空白除去 を1回の translate で
+_DEPTH_Z2H_TABLE = str.maketrans({
+    "－": "-",
+    "０": "0", "１": "1", "２": "2", "３": "3", "４": "4",
+    "５": "5", "６": "6", "７": "7", "８": "8", "９": "9",
+    "．": ".",
+    "〜": "-", "～": "-", "~": "-", "–": "-",
+    " ": None,
+})
+
+@lru_cache(maxsize=4096)
 def _normalize_depth_str(v: Optional[str]) -> Optional[str]:
     """
     深さ/厚さの表示候補を正規化（全角→半角・~/-統一・末尾mmなどを補正）
     """
     if not v:
         return None
-    s = str(v).strip()
-    z2h = str.maketrans("－０１２３４５６７８９．〜～", "-0123456789.~")
-    s = s.translate(z2h)
-    s = s.replace(" ", "")
+    s = str(v).strip().translate(_DEPTH_Z2H_TABLE)
     # 先頭のプレフィクスを軽く除去
-    s = re.sub(r"^(処理する深さ・厚さ|処理深さ|厚さ)\s*[:：]?\s*", "", s)
-    # レンジの ~ を - に
-    s = s.replace("~", "-").replace("–", "-")
+    s = _DEPTH_PREFIX_RE.sub("", s)
     # 単値なら mm 付与
-    if re.fullmatch(r"\d+(?:\.\d+)?", s):
+    if _BARE_NUM_RE.fullmatch(s):
         s = s + "mm"
     # "mm" 統一
-    s = re.sub(r"(?<=\d)\s*mm$", "mm", s, flags=re.I)
+    s = _MM_TAIL_RE.sub("mm", s)
     return s
 
 def _sort_depth_strings(vals: List[str]) -> List[str]:
     def keyfun(x: str):
-        m = re.match(r"(\d+(?:\.\d+)?)(?:-(\d+(?:\.\d+)?))?", x)
+        m = _DEPTH_SORT_RE.match(x)
         if m:
             lo = float(m.group(1))
             hi = float(m.group(2)) if m.group(2) else lo
@@ -196,95 +324,168 @@ def _collect_depth_candidates_from_rows(rows: List[Dict[str, Any]], limit: int =
 # ==============================
 # 行マッチ（AND/OR）
 # ==============================
-def _cell_contains_any(row_val: str, wants: List[str]) -> bool:
+@lru_cache(maxsize=4096)
+def _split_parts(row_val: str) -> Tuple[str, frozenset]:
     """
-    カンマ区切り・全角/半角・カッコ差・ハイフン揺れを吸収して 'OR' マッチ
+    セル値を (全体の正規化値, 区切り要素ごとの正規化値の集合) に。
+    同じセル文字列は何度も現れるのでキャッシュして正規化を1回で済ませる。
     """
-    if not wants:
-        return True
     rv_norm = _canon_text(row_val)
-    parts = [_canon_text(p) for p in re.split(r"[、,]", row_val or "")]
-    if not parts:
-        parts = [rv_norm]
+    raw = row_val or ""
+    if "、" not in raw and "," not in raw:
+        return rv_norm, frozenset((rv_norm,))  # 区切り無し（大半）は分割不要
+    return rv_norm, frozenset(_canon_text(p) for p in _SEP_SPLIT_RE.split(raw))
 
-    for w in wants:
-        cw = _canon_text(w)
-        # 完全一致 or 要素一致
-        if cw == rv_norm or cw in parts:
-            return True
-    return False
-
-def _depth_match_row(row_depth_cell: str,
-                     depth_range: Optional[Tuple[float, float]],
-                     depth_value: Optional[float],
-                     wants_depth_strings: List[str]) -> bool:
-    """
-    優先順:
-      1) depth_range: 行レンジと重なりがあるか
-      2) depth_value: 行レンジに包含されるか
-      3) wants_depth_strings（後方互換）: いずれかが包含されるか
-      4) いずれも未指定なら True
-    """
-    rng = _parse_depth_range(row_depth_cell)
-
-    if depth_range:
-        if rng is None:
-            return False
-        return _range_overlap(rng, depth_range)
+def _cell_tokens(row_val: str) -> Tuple[str, ...]:
+    # セル全体の正規化値 + 区切り要素の正規化値（重複なし）
+    rv_norm, parts = _split_parts(row_val)
+    return tuple(parts | {rv_norm})
 
-    if depth_value is not None:
-        if rng is None:
-            return False
-        return (rng[0] <= depth_value <= rng[1])
+def _col_rows(t: _Table, col: str, canon_wants: frozenset) -> np.ndarray:
+    """
+    カンマ区切り・全角/半角・カッコ差・ハイフン揺れを吸収して 'OR' マッチした行番号（昇順）
+    （セル全体 or 区切り要素のどれかが正規化後に一致すれば該当）
+    """
+    post = t.postings[col]
+    lists = [post[c] for c in canon_wants if c in post]
+    if not lists:
+        return np.empty(0, dtype=np.intp)
+    if len(lists) == 1:
+        return lists[0]
+    return np.unique(np.concatenate(lists))
 
-    if wants_depth_strings:
-        if rng is None:
-            return False
-        lo, hi = rng
-        for s in wants_depth_strings:
-            v = _to_mm_value(s)
-            if v is None:
-                continue
-            if lo <= v <= hi:
-                return True
-        return False
+DepthPred = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+# ハッシュ可能なクエリの正規形: (列ごとの希望値の正規化集合, 深さ区間, 旧互換の深さ値)
+QuerySig = Tuple[Tuple[Tuple[str, frozenset], ...], Optional[Tuple[float, float]], Optional[Tuple[float, ...]]]
 
-    return True
+def _depth_bounds(q: QuerySpec) -> Optional[Tuple[float, float]]:
+    """
+    depth_range / depth_value を重なり判定用の区間 (q_lo, q_hi) に。
+    値 v の包含判定 lo <= v <= hi は区間 (v, v) との重なり判定と同じ。
+    """
+    if q.depth_range:
+        return (q.depth_range[0], q.depth_range[1])
+    if q.depth_value is not None:
+        return (q.depth_value, q.depth_value)
+    return None
+
+def _depth_only_rows(t: _Table, q_lo: float, q_hi: float) -> np.ndarray:
+    """
+    深さ区間だけの問い合わせ: lo 昇順索引の二分探索で lo <= q_hi の行に絞り、その中で hi >= q_lo を判定。
+    行番号は CSV 順（昇順）で返す。
+    """
+    head = t.lo_order[:np.searchsorted(t.lo_sorted, q_hi, side="right")]
+    return np.sort(head[t.depth_hi[head] >= q_lo])
+
+def _freeze(q: QuerySpec) -> QuerySig:
+    """
+    QuerySpec を結果キャッシュのキーにできる正規形に。
+    表記ゆれ（全角/半角・ハイフン・値の順序や重複）は正規化後に同じキーになる。
+    """
+    wanted = tuple((col, frozenset(_canon_text(w) for w in getattr(q, col)))
+                   for col in _MATCH_COLS if getattr(q, col))
+    bounds = _depth_bounds(q)
+    legacy: Optional[Tuple[float, ...]] = None
+    if bounds is None and q.depth_strings:
+        legacy = tuple(sorted({v for v in map(_to_mm_value, q.depth_strings) if v is not None}))
+    return (wanted, bounds, legacy)
 
-def _row_match(row: Dict[str, str], q: Dict[str, Any]) -> bool:
-    # 各キーは AND、値配列は OR
-    if not _cell_contains_any(row.get("下地の状況", ""),         q.get("下地の状況", [])):         return False
-    if not _cell_contains_any(row.get("作業名", ""),             q.get("作業名", [])):             return False
-    if not _cell_contains_any(row.get("機械カテゴリー", ""),     q.get("機械カテゴリー", [])):     return False
-    if not _cell_contains_any(row.get("ライナックス機種名", ""), q.get("ライナックス機種名", [])): return False
-    if not _cell_contains_any(row.get("使用カッター名", ""),     q.get("使用カッター名", [])):     return False
-    if not _cell_contains_any(row.get("工程数", ""),             q.get("工程数", [])):             return False
+def _compile_depth(bounds: Optional[Tuple[float, float]],
+                   legacy: Optional[Tuple[float, ...]]) -> Optional[DepthPred]:
+    """
+    深さ条件を (lo配列, hi配列) -> 真偽配列 の関数に。優先順:
+      1) depth_range / depth_value（bounds）: 行レンジと重なりがあるか
+      2) 旧互換の深さ文字列（legacy）: いずれかの値が包含されるか
+      3) いずれも未指定なら None（深さ判定そのものを省く）
+    行レンジが解釈できない行（NaN）は 1)〜2) では常に False。
+    """
+    if bounds is not None:
+        q_lo, q_hi = bounds
+        return lambda lo, hi: (hi >= q_lo) & (q_hi >= lo)
 
-    # 深さ条件
-    depth_range = q.get("depth_range")                    # 例: (lo, hi)
-    depth_value = q.get("depth_value")                    # 例: 3.0
-    wants_depth_strings = q.get("処理する深さ・厚さ", [])  # 旧互換
+    if legacy is not None:
+        def _any_contains(lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+            mask = np.zeros(len(lo), dtype=bool)
+            for v in legacy:
+                mask |= (lo <= v) & (v <= hi)
+            return mask
+        return _any_contains
 
-    if not _depth_match_row(row.get("処理する深さ・厚さ", ""),
-                            depth_range, depth_value, wants_depth_strings):
-        return False
+    return None
 
-    # 作業効率評価（◎/○/〇/△）は OR
-    if not _cell_contains_any(row.get("作業効率評価", ""),       q.get("作業効率評価", [])):       return False
+def _compile_query(sig: QuerySig) -> Callable[[_Table], np.ndarray]:
+    """
+    クエリを「テーブル -> 該当行番号（CSV 順＝昇順）」の関数に特殊化する。
+    - 指定のある列だけを対象に、希望値の正規化集合（_freeze 済み）で引く
+    - 深さ条件は種類ごとの判定関数を1回だけ選ぶ（未指定なら判定しない）
+    各キーは AND、値配列は OR。文字列条件は転置索引の積集合（小さい順に交差）で候補を絞り、深さは候補行だけ判定する。
+    """
+    wanted, bounds, legacy = sig
+    depth = _compile_depth(bounds, legacy)
+
+    def match(t: _Table) -> np.ndarray:
+        cands: List[np.ndarray] = []
+        for col, canon_wants in wanted:
+            rows = _col_rows(t, col, canon_wants)
+            if not len(rows):
+                return rows  # どれか1列でも該当なしなら残りの列・深さは見ない
+            cands.append(rows)
+        if not cands:
+            # 深さだけ（or 条件なし）の問い合わせが最多なので専用経路
+            if depth is None:
+                return np.arange(len(t.values), dtype=np.intp)
+            if bounds is not None:
+                return _depth_only_rows(t, *bounds)
+            return np.flatnonzero(depth(t.depth_lo, t.depth_hi))
+        cands.sort(key=len)
+        idx = cands[0]
+        for other in cands[1:]:
+            if not len(idx):
+                break
+            idx = np.intersect1d(idx, other, assume_unique=True)
+        if depth is None:
+            return idx
+        return idx[depth(t.depth_lo[idx], t.depth_hi[idx])]
+
+    return match
+
+# _match_rows_cached に呼び出し側のテーブルを渡す受け口（lru のキーには入れず key だけで引く）。
+# _load_table_at で引き直すと、検索中に CSV が差し替わったとき旧キーで新ファイルを読んでしまい行番号がずれる
+_MATCH_TABLES: "weakref.WeakValueDictionary[Tuple[str, float], _Table]" = weakref.WeakValueDictionary()
+
+@lru_cache(maxsize=256)
+def _match_rows_cached(table_key: Tuple[str, float], sig: QuerySig) -> np.ndarray:
+    # 「多すぎる→絞り込み」の往復や range_out 時の深さ無し再検索で同じクエリが続くので結果を覚えておく。
+    # キーに CSV の (path, mtime) を含むので、CSV が差し替えられれば古い結果は使われない
+    t = _MATCH_TABLES[table_key]
+    idx = _compile_query(sig)(t)
+    # 既定の並び: 単一工程 → 評価◎→○/〇→△（ロード時に作った順位キーで安定ソート）
+    idx = idx[np.argsort(t.order[idx], kind="stable")]
+    idx.setflags(write=False)  # キャッシュ共有物
+    return idx
 
-    return True
+def _match_rows(t: _Table, q: QuerySpec) -> np.ndarray:
+    """該当行番号を既定の並び順で返す（読み取り専用の共有配列）"""
+    _MATCH_TABLES[t.key] = t  # 呼び出し中は t を握っているので弱参照でも消えない
+    return _match_rows_cached(t.key, _freeze(q))
 
 # ==============================
 # 並び順
 # ==============================
-def _sort_key(row: Dict[str, str]) -> Tuple[int, int]:
-    # 単一工程を優先、次に評価（◎>○/〇>△）
-    eng = row.get("工程数", "")
+_EFF_RANK = {"◎": 0, "○": 1, "△": 2}
+
+@lru_cache(maxsize=256)
+def _sort_key_of(eng: str, eff: Optional[str]) -> Tuple[int, int]:
+    # 工程数・評価はどちらも値の種類が少ないので、文字列処理は値ごとに1回だけ
     k_eng = 0 if "単一" in eng else 1
-    eff = (row.get("作業効率評価", "") or "").replace("〇", "○")
-    k_eff = {"◎": 0, "○": 1, "△": 2}.get(eff, 9)
+    k_eff = _EFF_RANK.get((eff or "").replace("〇", "○"), 9)
     return (k_eng, k_eff)
 
+def _sort_key(row: Dict[str, str]) -> Tuple[int, int]:
+    # 単一工程を優先、次に評価（◎>○/〇>△）
+    return _sort_key_of(row.get("工程数", ""), row.get("作業効率評価", ""))
+
 def sort_by_eval(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return sorted(rows, key=lambda r: EVAL_ORDER.get((r.get("作業効率評価", "") or ""), 9))
 
@@ -297,14 +498,10 @@ try:
 except Exception:
     _adapter_run = None
 
-def _stage_hit_flag_for_row(row_stage_norm: Optional[str], q: Dict[str, Any]) -> bool:
+def _want_stage_norms(wants: Sequence[str]) -> frozenset:
     """
-    工程フィルタが指定されているときのみ、row が工程的にヒットしたかを判定。
+    工程フィルタの指定値を 'SINGLE' / 'A' / 'B' の集合に正規化（クエリごとに1回）。
     """
-    wants: List[str] = q.get("工程数", []) or []
-    if not wants:
-        return False  # 工程フィルタ未指定時は False（情報として付与しない）
-    # 正規化セット
     want_norms = set()
     for w in wants:
         n = _normalize_stage(w)
@@ -317,9 +514,14 @@ def _stage_hit_flag_for_row(row_stage_norm: Optional[str], q: Dict[str, Any]) ->
             want_norms.add("B")
         if "単一" in str(w):
             want_norms.add("SINGLE")
-    if not want_norms:
-        return False
-    return (row_stage_norm in want_norms)
+    return frozenset(want_norms)
+
+def _stage_hit_flag_for_row(row_stage_norm: Optional[str], q: QuerySpec) -> bool:
+    """
+    工程フィルタが指定されているときのみ、row が工程的にヒットしたかを判定。
+    工程フィルタ未指定時は False（情報として付与しない）。
+    """
+    return row_stage_norm in q.stage_norms
 
 def run_query_system(query: Any) -> List[Dict[str, Any]]:
     """
@@ -339,65 +541,53 @@ def run_query_system(query: Any) -> List[Dict[str, Any]]:
             raise RuntimeError("search_adapter が見つかりません。dict クエリで呼び出してください。")
         return _adapter_run(query)  # type: ignore
 
-    rows = _load_rows()
+    return _hit_rows(QuerySpec.from_dict(query))
+
+def _hit_rows(spec: QuerySpec) -> List[Dict[str, Any]]:
+    # 該当行を既定の並びで dict 化し、工程の付帯情報を付ける
+    table = _load_table()
+    idx = _match_rows(table, spec)  # 既定の並び（単一工程 → 評価◎→○/〇→△）済み
     hits: List[Dict[str, Any]] = []
-    for r in rows:
-        if _row_match(r, query):
-            rr = dict(r)
-            stage_norm = _normalize_stage(rr.get("工程数"))
-            rr["_stage"] = stage_norm
-            rr["_hit_stage"] = _stage_hit_flag_for_row(stage_norm, query)
-            hits.append(rr)
-
-    # 既定の並び: 単一工程 → 評価◎→○/〇→△
-    hits.sort(key=_sort_key)
+    for i in idx:
+        rr = table.row(i)
+        stage_norm = table.stage[i]
+        rr["_stage"] = stage_norm
+        rr["_hit_stage"] = _stage_hit_flag_for_row(stage_norm, spec)
+        hits.append(rr)
     return hits
 
 # ==============================
 # 高レベル API（UX分岐）
 # ==============================
+_NONEMPTY_KEYS = ("下地の状況", "作業名", "機械カテゴリー", "ライナックス機種名",
+                  "使用カッター名", "工程数", "作業効率評価", "処理する深さ・厚さ")
+
 def _is_query_empty(q: Dict[str, Any]) -> bool:
     """
     有効な条件が何も無ければ True。
     """
-    keys_multi = ["下地の状況", "作業名", "機械カテゴリー", "ライナックス機種名",
-                  "使用カッター名", "工程数", "作業効率評価", "処理する深さ・厚さ"]
-    if any(q.get(k) for k in keys_multi):
-        return False
-    if q.get("depth_value") is not None or q.get("depth_range") is not None:
-        return False
-    return True
-
-def _remove_depth(q: Dict[str, Any]) -> Dict[str, Any]:
-    nq = dict(q)
-    nq.pop("depth_value", None)
-    nq.pop("depth_range", None)
-    # 旧互換キーも除去
-    if isinstance(nq.get("処理する深さ・厚さ"), list):
-        nq["処理する深さ・厚さ"] = []
-    return nq
+    for k in _NONEMPTY_KEYS:
+        if q.get(k):
+            return False
+    return q.get("depth_value") is None and q.get("depth_range") is None
 
 def _estimate_allowed_range_without_depth(q: Dict[str, Any]) -> Optional[Tuple[float, float]]:
     """
     深さ条件を外した状態で該当行のレンジ最小/最大を推定。
     なければ全体から推定。
     """
-    # まずその他条件で絞る
-    base_rows = run_query_system(_remove_depth(q))
-    if not base_rows:
-        # 全体から推定
-        base_rows = _load_rows()
-
-    lows: List[float] = []
-    highs: List[float] = []
-    for r in base_rows:
-        rng = _parse_depth_range(r.get("処理する深さ・厚さ", ""))
-        if rng:
-            lows.append(rng[0]); highs.append(rng[1])
+    # まずその他条件で絞る（行 dict は作らず、ロード時に解析済みの深さレンジ配列を使う）
+    t = _load_table()
+    idx = _match_rows(t, QuerySpec.from_dict(q, ignore_depth=True))
+    if not len(idx):
+        # 全体から推定（ロード時に計算済み）
+        return t.depth_bounds
 
-    if not lows or not highs:
+    lows, highs = t.depth_lo[idx], t.depth_hi[idx]
+    parsed = ~np.isnan(lows)  # 深さを解釈できた行だけ
+    if not parsed.any():
         return None
-    return (min(lows), max(highs))
+    return (float(lows[parsed].min()), float(highs[parsed].max()))
 
 def _format_rows(hits: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
@@ -426,13 +616,17 @@ def run_query(query: Dict[str, Any]) -> SearchOutcome:
 
     # 3) 深さ指定があるときに推奨レンジ外を検出（depth_value のみを対象）
     depth_value = query.get("depth_value")
-    if depth_value is not None:
+    # depth_value だけで深さを絞ってヒットがあれば、その行のレンジが値を含む＝推奨範囲内なので推定は不要
+    # （depth_range 併用時は深さ判定が depth_range 側、list 以外の旧互換キーは深さを外すと効き始めるので、従来どおり推定する）
+    legacy = query.get("処理する深さ・厚さ")
+    within = hits and not query.get("depth_range") and (not legacy or isinstance(legacy, list))
+    if depth_value is not None and not within:
         est = _estimate_allowed_range_without_depth(query)
         if est is not None:
             min_mm, max_mm = est
             if not (min_mm <= depth_value <= max_mm):
                 # 深さ以外の条件で再フィルタ（深さを外す）
-                hits_wo_depth = run_query_system(_remove_depth(query))
+                hits_wo_depth = _hit_rows(QuerySpec.from_dict(query, ignore_depth=True))
                 sdepth = clamp_depth(depth_value, min_mm, max_mm)
                 msg = "処理する深さ・厚さが推奨する幅を超えているようです。"
                 if len(hits_wo_depth) > 0:
@@ -497,16 +691,17 @@ def build_stage_index(rows: List[Dict[str, Any]]) -> Dict[Tuple[str, str, str, s
     """
     未フィルタ候補を、キーごとに 一次工程 / 二次工程 / 単一 に分類して保持。
     """
-    idx: Dict[Tuple[str, str, str, str], Dict[str, List[Dict[str, Any]]]] = defaultdict(lambda: {"一次工程": [], "二次工程": [], "単一": []})
+    idx: Dict[Tuple[str, str, str, str], Dict[str, List[Dict[str, Any]]]] = {}
     for r in rows or []:
         key = _pair_key(r)
         stage = str(r.get("工程数", "")).strip()
-        if stage == "一次工程":
-            idx[key]["一次工程"].append(r)
-        elif stage == "二次工程":
-            idx[key]["二次工程"].append(r)
-        else:
-            idx[key]["単一"].append(r)
+        if stage not in ("一次工程", "二次工程"):
+            stage = "単一"
+        bucket = idx.get(key)
+        if bucket is None:
+            # 新しいキーのときだけ作る（defaultdict の factory 呼び出し・参照時の自動追加なし）
+            bucket = idx[key] = {"一次工程": [], "二次工程": [], "単一": []}
+        bucket[stage].append(r)
     return idx
 
 def augment_with_pair_candidates(current_rows: List[Dict[str, Any]],
@@ -520,17 +715,29 @@ def augment_with_pair_candidates(current_rows: List[Dict[str, Any]],
     if not current_rows or not previous_unfiltered_rows:
         return current_rows or []
 
-    prev_idx = build_stage_index(previous_unfiltered_rows)
-    augmented = list(current_rows)
-    seen = set()
-
+    # 先に current_rows が必要とする (キー, 反対側工程) だけを集める（出現順を保持）
+    needed: Dict[Tuple[Tuple[str, str, str, str], str], List[Dict[str, Any]]] = {}
     for r in current_rows:
         stage = str(r.get("工程数", "")).strip()
         if stage not in ("一次工程", "二次工程"):
             continue
-        key = _pair_key(r)
         want = "二次工程" if stage == "一次工程" else "一次工程"
-        candidates = prev_idx.get(key, {}).get(want, [])
+        needed.setdefault((_pair_key(r), want), [])
+    if not needed:
+        return list(current_rows)
+
+    # 未絞り込み候補は1パスだけ。必要なキーの行だけを拾う（全件の索引は作らない）
+    for c in previous_unfiltered_rows:
+        stage = str(c.get("工程数", "")).strip()
+        if stage not in ("一次工程", "二次工程"):
+            continue
+        bucket = needed.get((_pair_key(c), stage))
+        if bucket is not None:
+            bucket.append(c)
+
+    augmented = list(current_rows)
+    seen = set()
+    for candidates in needed.values():
         for c in candidates:
             sig = (
                 c.get("作業ID",""), c.get("作業名",""), c.get("下地の状況",""),
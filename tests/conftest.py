@@ -0,0 +1,5 @@
+# リポジトリ直下のモジュール（_csv_cache など）を `pytest` 単体起動でも import できるようにする
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
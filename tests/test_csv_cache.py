@@ -0,0 +1,38 @@
+# _csv_cache: 値は CSV の生文字列のまま返す（"01"→"1"・"0.50"→"0.5" のような型推論をしない）
+import pytest
+
+import _csv_cache
+
+CSV = "作業ID,深さ,工程数,備考\n01,0.50,002,NA\n10,1.0-2.0mm,一次,\n"
+
+@pytest.fixture
+def csv_path(tmp_path):
+    _csv_cache.clear()
+    yield tmp_path
+    _csv_cache.clear()
+
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-8-sig", "cp932"])
+def test_raw_strings_preserved(csv_path, encoding):
+    path = csv_path / "data.csv"
+    path.write_bytes(CSV.encode(encoding))
+
+    df = _csv_cache.read_frame(str(path))
+    assert list(df.columns) == ["作業ID", "深さ", "工程数", "備考"]
+    assert df["作業ID"].tolist() == ["01", "10"]
+    assert df["深さ"].tolist() == ["0.50", "1.0-2.0mm"]
+    assert df["工程数"].tolist() == ["002", "一次"]
+    assert df["備考"].tolist() == ["NA", ""]
+
+    rows = _csv_cache.read_rows(str(path))
+    assert rows[0] == {"作業ID": "01", "深さ": "0.50", "工程数": "002", "備考": "NA"}
+    assert rows[1]["備考"] == ""
+
+def test_c_engine_fallback_matches(csv_path, monkeypatch):
+    path = csv_path / "data.csv"
+    path.write_bytes(CSV.encode("utf-8"))
+    arrow = _csv_cache.read_frame(str(path))
+
+    _csv_cache.clear()
+    monkeypatch.setattr(_csv_cache, "_HAS_PYARROW", False)
+    fallback = _csv_cache.read_frame(str(path))
+    assert fallback.equals(arrow)
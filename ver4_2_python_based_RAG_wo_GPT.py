@@ -1,7 +1,19 @@
+import numpy as np
 import pandas as pd
+import io
+import os
+import pickle
 import re
+import sys
+import tempfile
 import unicodedata
+import weakref
+from functools import lru_cache
 from typing import Dict, List, Tuple
+try:
+    import ahocorasick  # pyahocorasick（任意。無ければ従来の総当たり）
+except Exception:
+    ahocorasick = None
 
 #―――――――――― 設定 ――――――――――#
 CSV_PATH = r"C:\Users\takeda\Documents\projectRAG\restructured_file.csv"
@@ -20,6 +32,9 @@ FILTER_COLUMNS = {
     "作業効率評価": ["作業効率評価"],
 }
 
+# norm_df で category 型にする低カーディナリティ列（raw_df は表示・返却用なので文字列のまま）
+CATEGORY_COLUMNS = ("工程数", "作業効率評価", "機械カテゴリー", "作業名", "下地の状況")
+
 CATEGORY_NUM_MAP = {
     "1": "作業名",
     "2": "下地の状況",
@@ -30,45 +45,122 @@ CATEGORY_NUM_MAP = {
     "7": "作業効率評価",
 }
 
+_PUNCT_RE = re.compile(r"[、。・，,]")
+_WS_RE = re.compile(r"\s+")
+_DEPTH_RE = re.compile(r"([0-9.]+)\s*-\s*([0-9.]+)")
+_NUM_RE = re.compile(r"[\d.]+")
+
 #―――――――――― ユーティリティ関数 ――――――――――#
 def normalize_text(s: str) -> str:
-    if pd.isna(s):
-        return ""
-    s = str(s)
-    s = unicodedata.normalize("NFKC", s)
-    s = re.sub(r"[、。・，,]", " ", s)
+    if not isinstance(s, str):  # 文字列なら pd.isna は不要
+        if pd.isna(s):
+            return ""
+        s = str(s)
+    if not s.isascii():  # ASCII は NFKC で変化しない
+        s = unicodedata.normalize("NFKC", s)
+    s = _PUNCT_RE.sub(" ", s)
     return s.strip().lower()
 
+def normalize_series(col: pd.Series) -> pd.Series:
+    # normalize_text の列版（fillna("") 済みの文字列列が前提。セルごとの apply を使わない）
+    return col.str.normalize("NFKC").str.replace(_PUNCT_RE, " ", regex=True).str.strip().str.lower()
+
 def load_data(path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
     raw_df = pd.read_csv(path, dtype=str).fillna("")
-    norm_df = raw_df.copy()
-    for c in raw_df.columns:
-        norm_df[c] = raw_df[c].apply(normalize_text)
+    norm_df = pd.DataFrame({c: normalize_series(raw_df[c]) for c in raw_df.columns}, index=raw_df.index)
+    # 値の種類が少ない列は category に（str.contains などが行ではなくカテゴリ値の数だけで済む）
+    for c in CATEGORY_COLUMNS:
+        if c in norm_df.columns:
+            norm_df[c] = norm_df[c].astype("category")
     return raw_df, norm_df
 
+# 類義語展開の対象列（6列すべて）
+SYNONYM_COLUMNS = [
+    "作業名", "下地の状況", "処理する深さ・厚さ",
+    "ライナックス機種名", "使用カッター名", "工程数"
+]
+
+def load_context(path: str):
+    """
+    load_data〜build_auto_synonyms の結果 (raw_df, norm_df, uniq, known_keywords, synonym_dict) を返す。
+    CSV 横の <CSV>.cache.pkl にキャッシュし、CSV とこのスクリプトの更新時刻・サイズが同じなら再計算しない。
+    """
+    src, me = os.stat(path), os.stat(__file__)
+    stamp = (src.st_mtime_ns, src.st_size, me.st_mtime_ns, me.st_size)
+    cache_path = path + ".cache.pkl"
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached["stamp"] == stamp:
+            return cached["context"]
+    except Exception:
+        pass  # 無い・壊れている・古い形式 → 作り直す
+
+    raw_df, norm_df = load_data(path)
+    context = (
+        raw_df,
+        norm_df,
+        build_unique_dict(norm_df),
+        build_known_keywords(raw_df),
+        build_auto_synonyms(norm_df, SYNONYM_COLUMNS),
+    )
+    tmp_path = None
+    try:
+        # 一時ファイル名はプロセスごとに別（CLI とサーバ/複数ワーカーが同時に書いても混ざらない）
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path) or ".",
+                                         prefix=os.path.basename(cache_path) + ".",
+                                         suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            pickle.dump({"stamp": stamp, "context": context}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)  # 書きかけのファイルを読まれないように置き換え
+    except Exception:
+        # 書き込めない環境ではキャッシュなしで続行（書きかけの一時ファイルは残さない）
+        if tmp_path is not None and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    return context
+
 def build_unique_dict(norm_df: pd.DataFrame) -> Dict[str, List[str]]:
     uniq: Dict[str, List[str]] = {}
     for cat, columns in FILTER_COLUMNS.items():
-        values = pd.concat([norm_df[c] for c in columns])
-        uniq[cat] = sorted(set(values.values) - {""})
+        # 1列だけなら concat しない。unique() は C 側（category 列なら出現カテゴリだけ）
+        values = norm_df[columns[0]] if len(columns) == 1 else pd.concat([norm_df[c] for c in columns], ignore_index=True)
+        uniq[cat] = sorted(v for v in values.unique() if v != "")
     return uniq
 
 def split_keywords(text: str) -> List[str]:
     text = normalize_text(text)
-    return re.split(r"\s+", text)
+    return _WS_RE.split(text)
 
 def expand_synonyms(keywords: List[str], synonym_dict: Dict[str, List[str]]) -> List[str]:
     expanded = []
     for word in keywords:
         expanded.append(word)
         expanded.extend(synonym_dict.get(word, []))
-    return list(set(expanded))
+    return list(dict.fromkeys(expanded))  # 重複除去（出現順を保つので毎回同じ並び）
 
 def build_auto_synonyms(norm_df: pd.DataFrame, target_columns: List[str], min_len: int = 2) -> Dict[str, List[str]]:
     keyword_map = {}
     values = set()
     for col in target_columns:
         values.update(norm_df[col].unique())
+    values = sorted(values)  # set の反復順に依存させない（各リストは常に同じ並び）
+    patterns = [v for v in values if len(v) >= min_len]
+    if ahocorasick is not None and patterns:
+        # 全 val を1つのオートマトンにまとめ、各 other を1パス走査して含まれる val を拾う（N² の `in` 判定をしない）
+        A = ahocorasick.Automaton()
+        for v in patterns:
+            A.add_word(v, v)
+        A.make_automaton()
+        for other in values:
+            found = set()
+            for _, val in A.iter(other):
+                if val != other and val not in found:
+                    found.add(val)
+                    keyword_map.setdefault(val, []).append(other)
+        return keyword_map
     for val in values:
         for other in values:
             if val == other:
@@ -77,18 +169,15 @@ def build_auto_synonyms(norm_df: pd.DataFrame, target_columns: List[str], min_le
                 keyword_map.setdefault(val, []).append(other)
     return keyword_map
 
+_BRACKET_RE = re.compile(r"[（）()「」【】\[\]〈〉]")
+_SEP_RE = re.compile(r"[,\u3001\u3002\u3000\s]+")
+
 def build_known_keywords(df: pd.DataFrame, min_length: int = 2) -> List[str]:
-    unique_words = set()
-    for col in df.columns:
-        for val in df[col]:
-            val = str(val)
-            val = re.sub(r"[（）()「」【】\[\]〈〉]", " ", val)
-            tokens = re.split(r"[,\u3001\u3002\u3000\s]+", val)
-            for t in tokens:
-                t_norm = normalize_text(t)
-                if len(t_norm) >= min_length and re.search(r'\w', t_norm):
-                    unique_words.add(t_norm)
-    return sorted(unique_words)
+    # 全セル → 括弧除去 → 区切りで分割 → 1語1行に展開 → 正規化、を列単位の str 演算で
+    cells = pd.Series(df.to_numpy(dtype=object).ravel(), dtype=object).astype(str)
+    tokens = normalize_series(cells.str.replace(_BRACKET_RE, " ", regex=True).str.split(_SEP_RE).explode())
+    keep = (tokens.str.len() >= min_length) & tokens.str.contains(r"\w", regex=True)
+    return sorted(set(tokens[keep]))
 
 def select_category_by_number() -> str:
     print("\nカテゴリを番号で選んでください（Enterでスキップ）:")
@@ -100,17 +189,36 @@ def select_category_by_number() -> str:
     return CATEGORY_NUM_MAP.get(choice, "")
 
 def parse_depth_range(text: str) -> Tuple[float, float]:
-    match = re.search(r"([0-9.]+)\s*-\s*([0-9.]+)", text)
+    match = _DEPTH_RE.search(text)
     if match:
         return float(match.group(1)), float(match.group(2))
     return (None, None)
 
+def depth_bounds(col: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    # parse_depth_range の列版: 各セルの (下限, 上限) を float 配列で。範囲表記でないセルは NaN
+    ext = col.str.extract(_DEPTH_RE, expand=True)
+    return ext[0].astype(float).to_numpy(), ext[1].astype(float).to_numpy()
+
 def is_value_in_range(value: float, text_range: str) -> bool:
+    # 単一セル用。列をまとめて判定するときは depth_bounds を使う
     low, high = parse_depth_range(text_range)
     if low is None or high is None:
         return False
     return low <= value <= high
 
+def match_known_keywords(known_keywords: List[str], needles: List[str]) -> List[str]:
+    """known_keywords のうち needles のどれかを部分文字列として含む語（known_keywords の順）。"""
+    if ahocorasick is None or "" in needles:  # 空文字はどの語にも含まれる（オートマトンには登録できない）
+        return [word for word in known_keywords if any(eq in word for eq in needles)]
+    if not needles:
+        return []
+    A = ahocorasick.Automaton()
+    for eq in needles:
+        A.add_word(eq, eq)
+    A.make_automaton()
+    # 語ごとに1パス走査し、最初の一致が見つかった時点で採用
+    return [word for word in known_keywords if next(A.iter(word), None) is not None]
+
 def suggest_filters(
     uniq: Dict[str, List[str]],
     query: str,
@@ -121,10 +229,10 @@ def suggest_filters(
     query_keywords = split_keywords(query)
     expanded_keywords = expand_synonyms(query_keywords, synonym_dict)
 
-    matched_terms = [word for word in known_keywords if any(eq in word for eq in expanded_keywords)]
+    matched_terms = match_known_keywords(known_keywords, expanded_keywords)
     print("\n[DEBUG] 抽出されたキーワード候補:", matched_terms)
 
-    depth_match = re.findall(r"[\d\\.]+", query)
+    depth_match = _NUM_RE.findall(query)
     if depth_match:
         try:
             val = float(depth_match[0])
@@ -142,81 +250,111 @@ def suggest_filters(
 
     return suggestions
 
+@lru_cache(maxsize=4096)
+def compile_terms(terms: Tuple[str, ...]) -> re.Pattern:
+    # 語のどれかを含む（OR）パターン。同じ語の組は再検索・再表示のたびにコンパイルし直さない
+    return re.compile("|".join(re.escape(t) for t in terms))
+
+def filter_index(norm_df: pd.DataFrame, filters: Dict[str, List[str]]) -> pd.Index:
+    # ヒット行の index だけを返す（DF は作らない。呼び出し側で raw_df.loc[...] する）
+    # 候補行 idx を条件ごとに絞り込み、後の条件は残った行だけを走査する
+    # 文字列条件は語数の少ない（＝絞り込みが強い）順、行ごとの判定になる深さは最後
+    idx = norm_df.index
+    text_filters = sorted(
+        ((cat, terms) for cat, terms in filters.items() if terms and cat != "処理する深さ・厚さ"),
+        key=lambda kv: len(kv[1]),
+    )
+    for cat, terms in text_filters:
+        pat = compile_terms(tuple(terms))
+        sub = np.zeros(len(idx), dtype=bool)
+        for col in FILTER_COLUMNS.get(cat, []):
+            sub |= norm_df.loc[idx, col].str.contains(pat, na=False).to_numpy(dtype=bool)
+        idx = idx[sub]
+
+    terms = filters.get("処理する深さ・厚さ")
+    if terms:
+        try:
+            target_value = float(terms[0])
+            lo, hi = depth_bounds(norm_df.loc[idx, "処理する深さ・厚さ"])
+            idx = idx[(lo <= target_value) & (target_value <= hi)]  # 解釈できない行は NaN なので False
+        except Exception as e:
+            print(f"[WARN] 深さの判定でエラー: {e.__class__.__name__} - {e}")
+            idx = idx[:0]
+    return idx
+
 def filter_data(norm_df: pd.DataFrame, filters: Dict[str, List[str]]) -> pd.DataFrame:
-    mask = pd.Series(True, index=norm_df.index)
-    for cat, terms in filters.items():
-        if not terms:
-            continue
-        if cat == "処理する深さ・厚さ":
-            try:
-                target_value = float(terms[0])
-                match_mask = norm_df["処理する深さ・厚さ"].apply(
-                    lambda x: is_value_in_range(target_value, x)
-                )
-                mask &= match_mask
-            except Exception as e:
-                print(f"[WARN] 深さの判定でエラー: {e.__class__.__name__} - {e}")
-                mask &= False
-        else:
-            pat = "|".join(re.escape(t) for t in terms)
-            sub = pd.Series(False, index=norm_df.index)
-            for col in FILTER_COLUMNS.get(cat, []):
-                sub |= norm_df[col].str.contains(pat, na=False)
-            mask &= sub
-    return norm_df[mask]
+    return norm_df.loc[filter_index(norm_df, filters)]
+
+PAIR_KEY_COLUMNS = ["作業名", "下地の状況", "処理する深さ・厚さ"]
+
+# id(df) → (df への弱参照, step_groups の結果)。同じ全件 DF（raw_df）に対する groupby は1回だけ
+_STEP_GROUPS_CACHE: Dict[int, Tuple[weakref.ref, Dict[Tuple[str, str, str, str], np.ndarray]]] = {}
+
+def step_groups(df: pd.DataFrame) -> Dict[Tuple[str, str, str, str], np.ndarray]:
+    # (作業名, 下地の状況, 処理する深さ・厚さ, 工程数) → 行位置。キーごとの等値マスクを作らず1回の groupby で
+    # load_data の結果は読み取り専用で使う前提なので、DF が生きている間は結果を使い回す
+    key = id(df)
+    hit = _STEP_GROUPS_CACHE.get(key)
+    if hit is not None and hit[0]() is df:
+        return hit[1]
+    groups = df.groupby(PAIR_KEY_COLUMNS + ["工程数"], sort=False).indices
+    _STEP_GROUPS_CACHE[key] = (weakref.ref(df, lambda _, k=key: _STEP_GROUPS_CACHE.pop(k, None)), groups)
+    return groups
+
+def step_rows(df: pd.DataFrame, groups, key: Tuple[str, str, str], step: str) -> pd.DataFrame:
+    pos = groups.get((*key, step))
+    return df.iloc[pos] if pos is not None else df.iloc[:0]
 
 def extract_engineering_pairs(filtered_hits: pd.DataFrame, full_df: pd.DataFrame) -> List[pd.DataFrame]:
-    seen = set()
     pairs = []
-    candidate_keys = [
-        (row["作業名"], row["下地の状況"], row["処理する深さ・厚さ"])
-        for _, row in filtered_hits.iterrows()
-        if row["工程数"] in ["一次工程", "二次工程"]
-    ]
+    candidate_keys = filtered_hits.loc[
+        filtered_hits["工程数"].isin(["一次工程", "二次工程"]), PAIR_KEY_COLUMNS
+    ].drop_duplicates().itertuples(index=False, name=None)
+    groups = step_groups(full_df)
     for key in candidate_keys:
-        if key in seen:
-            continue
-        seen.add(key)
-        step1 = full_df[
-            (full_df["作業名"] == key[0]) &
-            (full_df["下地の状況"] == key[1]) &
-            (full_df["処理する深さ・厚さ"] == key[2]) &
-            (full_df["工程数"] == "一次工程")
-        ]
-        step2 = full_df[
-            (full_df["作業名"] == key[0]) &
-            (full_df["下地の状況"] == key[1]) &
-            (full_df["処理する深さ・厚さ"] == key[2]) &
-            (full_df["工程数"] == "二次工程")
-        ]
+        step1 = step_rows(full_df, groups, key, "一次工程")
+        step2 = step_rows(full_df, groups, key, "二次工程")
         if not step1.empty and not step2.empty:
             pairs.append(pd.concat([step1, step2]))
     return pairs
 
+EFF_ORDER = {"◎": 0, "〇": 1, "○": 1, "△": 2}
+
+def step_rank(col: pd.Series) -> np.ndarray:
+    # 一次を含む → 0、二次を含む → 1、それ以外 → 2（行ごとの lambda を使わない）
+    return np.select(
+        [col.str.contains("一次", regex=False).to_numpy(dtype=bool),
+         col.str.contains("二次", regex=False).to_numpy(dtype=bool)],
+        [0, 1], 2,
+    ).astype("int8")
+
+def sort_results(df: pd.DataFrame) -> pd.DataFrame:
+    # 一次→二次→その他、工程内で◎→○/〇→△→その他（同順位は元の並びのまま）
+    step = step_rank(df["工程数"])
+    eff = df["作業効率評価"].str.strip().map(EFF_ORDER).fillna(99).to_numpy(dtype="int8")
+    return df.iloc[np.lexsort((eff, step))]
+
 def print_pair_results(pairs: List[pd.DataFrame]):
-    def sort(df):
-        df = df.copy()
-        order = {"◎": 0, "〇": 1, "○": 1, "△": 2}
-        df["_工程順"] = df["工程数"].map(lambda x: 0 if "一次" in x else 1 if "二次" in x else 2)
-        df["_効率順"] = df["作業効率評価"].map(lambda x: order.get(x.strip(), 99))
-        return df.sort_values(["_工程順", "_効率順"]).drop(columns=["_工程順", "_効率順"])
     if pairs:
-        print("\n===（一次工程＋二次工程ペア）===")
+        # まとめて1回で書き出す（ペアごとの print / 表文字列の生成をしない）
+        buf = io.StringIO()
+        buf.write("\n===（一次工程＋二次工程ペア）===\n")
         for i, pair in enumerate(pairs, 1):
-            print(f"\n--- ペア {i} ---")
-            print(sort(pair)[cols].to_string(index=False))
+            buf.write(f"\n--- ペア {i} ---\n")
+            sort_results(pair)[cols].to_string(buf, index=False)
+            buf.write("\n")
+        sys.stdout.write(buf.getvalue())
 
 def print_solo_results(df: pd.DataFrame, exclude_keys: List[Tuple[str, str, str]]):
-    def sort(df):
-        df = df.copy()
-        order = {"◎": 0, "〇": 1, "○": 1, "△": 2}
-        df["_工程順"] = df["工程数"].map(lambda x: 0 if "一次" in x else 1 if "二次" in x else 2)
-        df["_効率順"] = df["作業効率評価"].map(lambda x: order.get(x.strip(), 99))
-        return df.sort_values(["_工程順", "_効率順"]).drop(columns=["_工程順", "_効率順"])
-    df = df[~df.apply(lambda r: (r["作業名"], r["下地の状況"], r["処理する深さ・厚さ"]) in exclude_keys, axis=1)]
+    if exclude_keys and not df.empty:
+        keys = pd.MultiIndex.from_frame(df[PAIR_KEY_COLUMNS])
+        df = df[~keys.isin(list(exclude_keys))]
     if not df.empty:
-        print("\n=== 単一工程・その他の工法結果 ===\n")
-        print(sort(df)[cols].to_string(index=False))
+        buf = io.StringIO()
+        buf.write("\n=== 単一工程・その他の工法結果 ===\n\n")
+        sort_results(df)[cols].to_string(buf, index=False)
+        buf.write("\n")
+        sys.stdout.write(buf.getvalue())
 
 def print_row(row):
     print(f"{row['作業名']: <12} {row['下地の状況']: <20} {row['処理する深さ・厚さ']: <15} "
@@ -227,8 +365,6 @@ def summarize_and_print(results, raw_df):
         print("\n該当する工法は見つかりませんでした。")
         return
 
-    efficiency_order = {"◎": 0, "○": 1, "〇": 1, "△": 2}
-
     # 単一工程
     singles = results[results["工程数"] == "単一"]
 
@@ -237,75 +373,67 @@ def summarize_and_print(results, raw_df):
 
     # === ペア補完 ===
     pairs = []
-    seen_keys = set()
-    for _, row in multi_hits.iterrows():
-        key = (row["作業名"], row["下地の状況"], row["処理する深さ・厚さ"])
-        if key in seen_keys:
-            continue
-        seen_keys.add(key)
-
-        step1 = raw_df[
-            (raw_df["作業名"] == key[0]) &
-            (raw_df["下地の状況"] == key[1]) &
-            (raw_df["処理する深さ・厚さ"] == key[2]) &
-            (raw_df["工程数"] == "一次工程")
-        ]
-        step2 = raw_df[
-            (raw_df["作業名"] == key[0]) &
-            (raw_df["下地の状況"] == key[1]) &
-            (raw_df["処理する深さ・厚さ"] == key[2]) &
-            (raw_df["工程数"] == "二次工程")
-        ]
+    groups = step_groups(raw_df)
+    for key in multi_hits[PAIR_KEY_COLUMNS].drop_duplicates().itertuples(index=False, name=None):
+        step1 = step_rows(raw_df, groups, key, "一次工程")
+        step2 = step_rows(raw_df, groups, key, "二次工程")
 
         if not step1.empty or not step2.empty:
             # 工程ごとに◎→○→△ソート
-            step1_sorted = step1.sort_values(
-                by="作業効率評価", key=lambda col: col.map(efficiency_order)
-            )
-            step2_sorted = step2.sort_values(
-                by="作業効率評価", key=lambda col: col.map(efficiency_order)
-            )
-            pairs.append(pd.concat([step1_sorted, step2_sorted]))
+            pairs.append(pd.concat([sort_results(step1), sort_results(step2)]))
+
+    # 表示はバッファにためて最後に1回で書き出す
+    buf = io.StringIO()
 
     # === 単一工程表示（◎→○→△） ===
     if not singles.empty:
-        singles_sorted = singles.sort_values(
-            by="作業効率評価", key=lambda col: col.map(efficiency_order)
-        )
-        print("\n=== 単一工程・その他の工法結果 ===\n")
-        print(singles_sorted[
+        singles_sorted = sort_results(singles)
+        buf.write("\n=== 単一工程・その他の工法結果 ===\n\n")
+        singles_sorted[
             ["作業名", "下地の状況", "処理する深さ・厚さ",
              "ライナックス機種名", "使用カッター名", "工程数", "作業効率評価"]
-        ].to_string(index=False))
+        ].to_string(buf, index=False)
+        buf.write("\n")
 
     # === ペア表示（一次工程→二次工程、工程内で◎→○→△） ===
     if pairs:
-        print("\n===（一次工程＋二次工程ペア）===\n")
+        buf.write("\n===（一次工程＋二次工程ペア）===\n\n")
         for i, pair in enumerate(pairs, 1):
-            print(f"--- ペア {i} ---")
-            print(pair[
+            buf.write(f"--- ペア {i} ---\n")
+            pair[
                 ["作業名", "下地の状況", "処理する深さ・厚さ",
                  "ライナックス機種名", "使用カッター名", "工程数", "作業効率評価"]
-            ].to_string(index=False))
-            print()
+            ].to_string(buf, index=False)
+            buf.write("\n\n")
 
-    print(f"=== 総該当件数: {len(results)} 件 ===\n")
+    buf.write(f"=== 総該当件数: {len(results)} 件 ===\n\n")
+    sys.stdout.write(buf.getvalue())
 
 #―――――――――― メインフロー ――――――――――#
 
 def main():
-    raw_df, norm_df = load_data(CSV_PATH)
-    uniq = build_unique_dict(norm_df)
-    known_keywords = build_known_keywords(raw_df)
-
-    # ✅ 類義語展開の対象列を拡張（6列すべて）
-    synonym_dict = build_auto_synonyms(norm_df, [
-        "作業名", "下地の状況", "処理する深さ・厚さ",
-        "ライナックス機種名", "使用カッター名", "工程数"
-    ])
+    # ✅ 類義語展開の対象列を拡張（6列すべて → SYNONYM_COLUMNS）
+    raw_df, norm_df, uniq, known_keywords, synonym_dict = load_context(CSV_PATH)
 
     filters: Dict[str, List[str]] = {cat: [] for cat in FILTER_COLUMNS}
 
+    # (列, 語) → norm_df 全行の部分一致ビット列。norm_df はこのループ中変わらないので、
+    # 条件表示のたびに同じ語で str.contains をやり直さない（語が消えても古いエントリは使われないだけ）
+    match_cache: Dict[Tuple[str, str], np.ndarray] = {}
+
+    def term_mask(col: str, term: str) -> np.ndarray:
+        m = match_cache.get((col, term))
+        if m is None:
+            m = norm_df[col].str.contains(compile_terms((term,)), na=False).to_numpy(dtype=bool)
+            match_cache[(col, term)] = m
+        return m
+
+    def terms_mask(col: str, terms: List[str]) -> np.ndarray:
+        m = np.zeros(len(norm_df), dtype=bool)
+        for t in terms:
+            m |= term_mask(col, t)
+        return m
+
     while True:
         query = input("\n抽出したい工法またはキーワードを入力してください> ").strip()
         if not query:
@@ -330,21 +458,15 @@ def main():
                                 display = ["未指定（作業名または下地の状況の指定が必要）"]
                                 filters[cat] = []
                             else:
-                                sub_df = norm_df
-
+                                sub = np.ones(len(norm_df), dtype=bool)
                                 if filters["作業名"]:
-                                    work_pat = "|".join(re.escape(t) for t in filters["作業名"])
-                                    sub_df = sub_df[sub_df["作業名"].str.contains(work_pat, na=False)]
-
+                                    sub &= terms_mask("作業名", filters["作業名"])
                                 if filters["下地の状況"]:
-                                    base_pat = "|".join(re.escape(t) for t in filters["下地の状況"])
-                                    sub_df = sub_df[sub_df["下地の状況"].str.contains(base_pat, na=False)]
-
-                                matched_ranges = sorted({
-                                    raw_df.at[i, "処理する深さ・厚さ"]
-                                    for i in sub_df.index
-                                    if is_value_in_range(target_value, norm_df.at[i, "処理する深さ・厚さ"])
-                                })
+                                    sub &= terms_mask("下地の状況", filters["下地の状況"])
+
+                                lo, hi = depth_bounds(norm_df["処理する深さ・厚さ"][sub])
+                                in_range = (lo <= target_value) & (target_value <= hi)
+                                matched_ranges = sorted(set(raw_df["処理する深さ・厚さ"][sub][in_range]))
                                 display = matched_ranges if matched_ranges else ["未指定（該当なし）"]
                                 if display == ["未指定（該当なし）"]:
                                     filters[cat] = []
@@ -354,9 +476,7 @@ def main():
                         matched_values = set()
                         for col in FILTER_COLUMNS.get(cat, []):
                             for t in terms:
-                                matched_values |= set(
-                                    raw_df[col][norm_df[col].str.contains(re.escape(t), na=False)].unique()
-                                )
+                                matched_values |= set(raw_df[col][term_mask(col, t)].unique())
                         display = sorted(matched_values) if matched_values else ["未指定（該当なし）"]
                         if display == ["未指定（該当なし）"]:
                             filters[cat] = []
@@ -369,8 +489,7 @@ def main():
             ))
 
             if ans in ['y', '1']:
-                hits_norm = filter_data(norm_df, filters)
-                hits_raw = raw_df.loc[hits_norm.index]
+                hits_raw = raw_df.loc[filter_index(norm_df, filters)]
 
                 if hits_raw.empty:
                     print("該当データはありませんでした。")
@@ -408,7 +527,7 @@ def main():
                         if not t_norm:
                             continue
                         if cat_add == "処理する深さ・厚さ":
-                            match = re.search(r"[\d.]+", t_norm)
+                            match = _NUM_RE.search(t_norm)
                             if match:
                                 new_terms.append(match.group(0))
                             else:
@@ -443,7 +562,7 @@ def main():
                             if not t_norm:
                                 continue
                             if cat_mod == "処理する深さ・厚さ":
-                                match = re.search(r"[\d.]+", t_norm)
+                                match = _NUM_RE.search(t_norm)
                                 if match:
                                     new_terms.append(match.group(0))
                                 else: